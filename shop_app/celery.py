@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 import os
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from django.db import close_old_connections, connections
 
 
 os.environ.setdefault('DJANGO_SETTING_MODULE' , 'shop_app.settings')
@@ -9,4 +11,58 @@ app = Celery ('shop_app')
 
 app.config_from_object('django.conf:settings' , namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@task_prerun.connect
+def prepare_db_connections(**kwargs):
+    """
+    Закрываем устаревшие и оборванные соединения перед задачей,
+    живые переиспользуются в пределах CONN_MAX_AGE
+    """
+    from django.conf import settings
+
+    close_old_connections()
+    if settings.DATABASE_HEALTH_CHECKS:
+        for conn in connections.all():
+            if conn.connection is not None and not conn.is_usable():
+                conn.close()
+
+
+@task_postrun.connect
+def release_db_connections(**kwargs):
+    """
+    Соединение с незавершенной транзакцией или ошибкой не переходит в следующую задачу
+    """
+    for conn in connections.all():
+        if conn.connection is not None and conn.in_atomic_block:
+            conn.close()
+    close_old_connections()
+
+
+@before_task_publish.connect
+def stamp_published(headers=None, **kwargs):
+    """
+    Время постановки в очередь для расчета ожидания задачи
+    """
+    from shop_inter.task_metrics import mark_published
+
+    if headers is not None:
+        mark_published(headers)
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    from shop_inter.task_metrics import task_started
+
+    task_started(task_id, task.request)
+
+
+@task_postrun.connect
+def record_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    """
+    Время выполнения, ожидание в очереди и исход задачи (успех, ошибка, повтор)
+    """
+    from shop_inter.task_metrics import task_finished
+
+    task_finished(task_id, task.name, state)
@@ -52,11 +52,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'django.middleware.gzip.GZipMiddleware',
+    'shop_inter.middleware.BrotliMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop_inter.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -92,9 +95,28 @@ DATABASES = {
         'PASSWORD': env("DATABASE_PASSWORD"),
         'HOST': env("DATABASE_HOST"),
         'PORT': env("DATABASE_PORT"),
+        # постоянные соединения вместо нового подключения на каждый запрос и задачу celery
+        'CONN_MAX_AGE': env.int("DATABASE_CONN_MAX_AGE", default=60),
+        # при работе через PgBouncer в режиме transaction серверные курсоры недоступны
+        'DISABLE_SERVER_SIDE_CURSORS': env.bool("DATABASE_PGBOUNCER", default=False),
     }
 }
 
+# Реплики только для чтения: каталог и история заказов
+DATABASE_REPLICAS = []
+for number, host in enumerate(env.list("DATABASE_REPLICA_HOSTS", default=[]), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['shop_inter.routers.ReplicaRouter']
+
+# Сколько секунд после изменения клиент читает из основной базы
+REPLICA_PIN_SECONDS = 5
+
+# Проверять постоянное соединение запросом перед задачей celery
+DATABASE_HEALTH_CHECKS = env.bool("DATABASE_HEALTH_CHECKS", default=True)
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -147,18 +169,42 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 40,
 
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-
-    ),
+        'shop_inter.renderers.FastJSONRenderer',
+    ) + (('rest_framework.renderers.BrowsableAPIRenderer',) if DEBUG else ()),
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # 'rest_framework.authentication.SessionAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
+
+    'DEFAULT_THROTTLE_CLASSES': (
+        'shop_inter.throttling.LoadSheddingThrottle',
+        'shop_inter.throttling.TokenBucketThrottle',
+    ),
+}
+
+# Общий кеш (лимиты запросов, версии справочников), по умолчанию локальный для процесса.
+# В работе - redis через django-redis: CACHE_URL=rediscache://host:6379/1
+CACHES = {
+    'default': env.cache("CACHE_URL", default='locmemcache://'),
+}
+
+# Корзины токенов: capacity - максимум токенов, rate - пополнение в секунду.
+# Представление выбирает корзину через throttle_scope и списывает throttle_cost токенов за запрос
+RATE_LIMIT_BUCKETS = {
+    'default': {'capacity': 60, 'rate': 1},
+    'catalog': {'capacity': 120, 'rate': 2},
+    'orders': {'capacity': 60, 'rate': 0.5},
+    'partner_update': {'capacity': 100, 'rate': 0.2},
 }
 
+# Сброс нагрузки при медленной базе
+LOAD_SHED_DB_LATENCY = 0.5
+LOAD_SHED_MIN_COST = 5
+LOAD_SHED_CHECK_INTERVAL = 2
+LOAD_SHED_RETRY_AFTER = 30
+
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 AUTH_USER_MODEL='shop_inter.User'
 
@@ -175,4 +221,130 @@ CELERY_BROKER_URL = "redis://127.0.0.1:6379/0"
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'Europe/Moscow'
\ No newline at end of file
+CELERY_TIMEZONE = 'Europe/Moscow'
+# Отдельные очереди, чтобы медленная почта не задерживала импорт прайсов:
+# нужны воркеры для каждой очереди: -Q mail, -Q imports и -Q celery (остальные задачи), см. README
+CELERY_TASK_ROUTES = {
+    'shop_inter.tasks.new_order_func': {'queue': 'mail'},
+    'shop_inter.tasks.new_order_shop': {'queue': 'mail'},
+    'shop_inter.tasks.notify_order_placed': {'queue': 'mail'},
+    'shop_inter.tasks.notify_status_changed': {'queue': 'mail'},
+    'shop_inter.tasks.notify_price_imported': {'queue': 'mail'},
+    'shop_inter.tasks.send_email': {'queue': 'mail'},
+    'shop_inter.tasks.import_shop_price': {'queue': 'imports'},
+    'shop_inter.tasks.refresh_shop_prices': {'queue': 'imports'},
+    'shop_inter.tasks.refresh_shop_price': {'queue': 'imports'},
+    'shop_inter.tasks.build_catalog_snapshots': {'queue': 'imports'},
+}
+# долгие импорты не забирают задачи впрок у свободных воркеров
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'schedule-price-refresh': {
+        'task': 'shop_inter.tasks.schedule_price_refresh',
+        'schedule': 60.0,
+    },
+    'archive-orders': {
+        'task': 'shop_inter.tasks.archive_orders',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'sweep-idempotency-keys': {
+        'task': 'shop_inter.tasks.sweep_idempotency_keys',
+        'schedule': 60 * 60.0,
+    },
+    'relay-outbox': {
+        'task': 'shop_inter.tasks.relay_outbox',
+        'schedule': 5.0,
+    },
+    'sweep-outbox': {
+        'task': 'shop_inter.tasks.sweep_outbox',
+        'schedule': 60 * 60.0,
+    },
+    'cleanup-expired': {
+        'task': 'shop_inter.tasks.cleanup_expired',
+        'schedule': 60 * 60.0,
+    },
+    'build-catalog-snapshots': {
+        'task': 'shop_inter.tasks.build_catalog_snapshots',
+        'schedule': 24 * 60 * 60.0,
+    },
+}
+
+# Автоматическое обновление прайсов магазинов.
+# SHOP_REFRESH_BATCH - сколько магазинов обновляется одновременно, включая ожидающие в очереди
+SHOP_REFRESH_BATCH = 50
+SHOP_REFRESH_CONCURRENCY = 10
+SHOP_REFRESH_HOST_DELAY = 30
+SHOP_REFRESH_JITTER = 300
+# предельное время загрузки одного прайса целиком (с)
+SHOP_REFRESH_TIMEOUT = 60
+
+# Архивация доставленных и отмененных заказов старше ORDER_ARCHIVE_AGE дней
+ORDER_ARCHIVE_AGE = env.int("ORDER_ARCHIVE_AGE", default=180)
+ORDER_ARCHIVE_BATCH = 1000
+
+# Сколько секунд хранится ответ на запрос с Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Через сколько секунд ключ, занятый незавершенным запросом, можно занять повтором
+IDEMPOTENCY_LEASE = 60
+IDEMPOTENCY_SWEEP_BATCH = 5000
+
+# Сколько лучших предложений хранить по продукту и сколько продуктов сравнивать за запрос
+BEST_OFFERS_TOP = 5
+BEST_OFFERS_MAX_PRODUCTS = 100
+
+# Размер пачки при массовой смене статуса заказов
+ORDER_STATUS_BATCH = 1000
+
+# Ретрансляция событий outbox: размер пачки, пауза между пустыми проходами (сек),
+# сколько дней хранить переданные события
+OUTBOX_BATCH = 500
+OUTBOX_IDLE_SLEEP = 1
+OUTBOX_RETENTION_DAYS = 7
+
+# Лента новых заказов для поставщиков: redis для раздачи событий между процессами
+# (без него ожидающие запросы опрашивают базу раз в ORDER_FEED_POLL_INTERVAL), время ожидания long-poll,
+# интервал keep-alive и длительность одного SSE соединения (сек), размер буфера событий процесса
+ORDER_FEED_REDIS_URL = env("ORDER_FEED_REDIS_URL", default=CELERY_BROKER_URL)
+ORDER_FEED_TIMEOUT = 25
+ORDER_FEED_KEEPALIVE = 15
+ORDER_FEED_STREAM_SECONDS = 300
+ORDER_FEED_BUFFER = 1000
+ORDER_FEED_POLL_INTERVAL = 5
+# Сколько потоков SSE и ожидающих long-poll запросов держит один процесс вместе;
+# должно быть меньше числа его потоков (gunicorn --threads)
+ORDER_FEED_MAX_STREAMS = env.int("ORDER_FEED_MAX_STREAMS", default=4)
+
+# Выгрузка каталога: каталог снимков, размер пачки чтения и сколько ждать построения снимка (сек)
+EXPORT_DIR = env("EXPORT_DIR", default=os.path.join(BASE_DIR, 'export'))
+EXPORT_BATCH = 2000
+EXPORT_BUILD_TIMEOUT = 60 * 60
+
+# Наибольшее число изменений цен и остатков в одном запросе partner/deltas
+PARTNER_DELTA_MAX_ITEMS = 10000
+
+# Сколько ошибок проверки прайса сохранять в отчете
+FEED_MAX_ERRORS = 1000
+
+# Наибольшее число строк в отчетах о продажах по продуктам и категориям
+SALES_REPORT_MAX_ROWS = 1000
+
+# Очистка устаревших данных: срок жизни токенов подтверждения почты (ч),
+# через сколько дней без изменений корзина считается брошенной, размер и число пачек за запуск
+CONFIRM_EMAIL_TOKEN_TTL = env.int("CONFIRM_EMAIL_TOKEN_TTL", default=48)
+STALE_BASKET_DAYS = env.int("STALE_BASKET_DAYS", default=60)
+CLEANUP_BATCH = 1000
+CLEANUP_MAX_BATCHES = 100
+
+# Метрики задач celery: redis для счетчиков и границы корзин гистограмм (сек)
+TASK_METRICS_REDIS_URL = env("TASK_METRICS_REDIS_URL", default=CELERY_BROKER_URL)
+TASK_METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Размер страницы при потоковой выдаче больших списков
+STREAM_PAGE_SIZE = 500
+
+# Как часто процесс сверяет версию справочников параметров и категорий (с)
+NAME_CACHE_CHECK_INTERVAL = 5
+
+# Сколько секунд хранятся признаки версии каталога для ETag, если их не сбросило изменение
+# (с локальным кешем сброс виден только в своем процессе)
+CATALOG_STAMP_TTL = 60
@@ -0,0 +1,28 @@
+"""
+Настройки для тестов без PostgreSQL: основная база и реплика - два файла SQLite.
+Реплика в тестах зеркалит основную базу, поэтому видит те же данные, а маршрутизация
+проверяется по тому, через какое соединение прошли запросы.
+
+python manage.py test --settings=shop_app.settings_test
+
+Тесты запросов, которых нет в SQLite, здесь пропускаются - их запускают с settings_test_postgres.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'replica1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_REPLICAS = ['replica1']
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
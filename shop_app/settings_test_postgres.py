@@ -0,0 +1,26 @@
+"""
+Настройки для тестов на PostgreSQL: запускают и тесты с запросами, которых нет в SQLite
+(UPDATE ... FROM (VALUES ...) в apply_deltas, INSERT ... ON CONFLICT в сводках продаж).
+Подключение берется из тех же переменных окружения DATABASE_*, что и в settings.py,
+тестовая база создается рядом с основной. Реплика зеркалит основную базу, как в settings_test.py.
+
+python manage.py test --settings=shop_app.settings_test_postgres
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES as PRIMARY_DATABASES
+
+DATABASES = {
+    'default': dict(PRIMARY_DATABASES['default'], CONN_MAX_AGE=0),
+    'replica1': dict(PRIMARY_DATABASES['default'], CONN_MAX_AGE=0, TEST={'MIRROR': 'default'}),
+}
+DATABASE_REPLICAS = ['replica1']
+
+# миграций в репозитории нет: схема shop_inter создается без них и ссылается на таблицы auth,
+# поэтому в тестах все приложения создаются по моделям, без миграций
+MIGRATION_MODULES = {label: None for label in (
+    'admin', 'auth', 'contenttypes', 'sessions', 'authtoken', 'django_rest_passwordreset')}
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
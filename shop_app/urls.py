@@ -19,7 +19,9 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 from rest_framework import routers
 
 from shop_inter.views import PartnerUpdate, PartnerState, PartnerOrders, RegisterAccount, ConfirmAccount, \
-    AccountDetails, ContactView, LoginAccount, CategoryView, ShopView, ProductView, BasketView, OrderView
+    AccountDetails, ContactView, LoginAccount, CategoryView, ShopView, ProductView, BasketView, OrderView, \
+    OrderHistoryView, PriceChangesView, OffersView, PartnerOrderStatus, PartnerOrderFeed, CatalogExport, PartnerDeltas, \
+    SalesReport, TaskMetricsView
 
 router = routers.DefaultRouter()
 router.register(r'products', ProductView)
@@ -27,7 +29,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
+    path('partner/deltas', PartnerDeltas.as_view(), name='partner-deltas'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
+    path('partner/orders/status', PartnerOrderStatus.as_view(), name='partner-orders-status'),
+    path('partner/orders/feed', PartnerOrderFeed.as_view(), name='partner-orders-feed'),
     path('user/register', RegisterAccount.as_view(), name='user-register'),
     path('user/register/confirm', ConfirmAccount.as_view(), name='user-register-confirm'),
     path('user/details', AccountDetails.as_view(), name='user-details'),
@@ -38,7 +43,13 @@ urlpatterns = [
     path('categories', CategoryView.as_view(), name='categories'),
     path('shops', ShopView.as_view(), name='shops'),
     # path('products', ProductInfoView.as_view(), name='shops'),
+    path('catalog/export/<str:export_format>', CatalogExport.as_view(), name='catalog-export'),
+    path('products/offers', OffersView.as_view(), name='product-offers'),
+    path('products/price_changes', PriceChangesView.as_view(), name='price-changes'),
     path('',include(router.urls)),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
+    path('metrics/tasks', TaskMetricsView.as_view(), name='task-metrics'),
+    path('sales/<str:kind>', SalesReport.as_view(), name='sales-report'),
+    path('order/history', OrderHistoryView.as_view(), name='order-history'),
 ]
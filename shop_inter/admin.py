@@ -1,7 +1,38 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
-from .models import User, Shop, Parameter, ProductInfo, Product, ProductParameter, Category, Order, OrderItem, Contact
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from .models import User, Shop, Parameter, ProductInfo, Product, ProductParameter, Category, Order, OrderItem, Contact, \
+    ArchivedOrder, ArchivedOrderItem, OutboxEvent, PriceImport, STATE_CHOICES
+from .order_status import transition_orders, allowed_sources
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Для больших таблиц без фильтров берет оценку числа строк из статистики Postgres вместо COUNT(*)
+    """
+    estimate_from = 100000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [query.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_from:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Базовая панель для больших таблиц
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # Register your models here.
@@ -24,52 +55,121 @@ class CustomUserAdmin(UserAdmin):
 
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'state',)
+    list_display = ('id', 'name', 'state', 'refresh_interval', 'last_refresh', 'last_refresh_duration',
+                    'last_refresh_lag',)
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    pass
+    search_fields = ('name',)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ('id', 'name', 'model', 'category')
+    list_select_related = ('category',)
+    autocomplete_fields = ('category',)
 
 
 @admin.register(ProductInfo)
-class ProductInfoAdmin(admin.ModelAdmin):
-    pass
+class ProductInfoAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'shop', 'model', 'quantity', 'price', 'price_rrc')
+    list_select_related = ('product', 'shop')
+    list_filter = ('shop',)
+    raw_id_fields = ('product', 'name', 'shop')
 
 
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
-    pass
+    search_fields = ('name',)
 
 
 @admin.register(ProductParameter)
-class ProductParameterAdmin(admin.ModelAdmin):
-    pass
+class ProductParameterAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'parameter', 'value')
+    list_select_related = ('product', 'parameter')
+    raw_id_fields = ('product',)
+    autocomplete_fields = ('parameter',)
 
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
-    fields = ('id', 'product', 'shop', 'quantity')
+    fields = ('id', 'product', 'shop', 'quantity', 'price')
+    raw_id_fields = ('product', 'shop')
     list_display_links = ['id']
+    extra = 0
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('id', 'product', 'shop', 'quantity')
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'product', 'shop', 'quantity', 'price')
+    list_select_related = ('order', 'product', 'shop')
+    raw_id_fields = ('order', 'product', 'shop')
+
+
+def make_status_action(status, name):
+    def action(modeladmin, request, queryset):
+        updated, rejected = transition_orders(queryset.values_list('id', flat=True), status)
+        modeladmin.message_user(request, f'Статус "{name}" установлен у {len(updated)} заказов, '
+                                         f'недопустимый переход у {len(rejected)}')
+    action.__name__ = f'set_status_{status}'
+    action.short_description = f'Установить статус "{name}"'
+    return action
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    # inlines = (OrderItemInline, )
-    pass
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'dt', 'status', 'contact')
+    list_select_related = ('user', 'contact')
+    list_filter = ('status', 'sub_orders__shop')
+    raw_id_fields = ('user', 'contact')
+    inlines = (OrderItemInline, )
+    # статус меняется только действиями: transition_orders проверяет переход, пишет событие в outbox
+    # и при отмене вычитает заказ из сводок продаж
+    readonly_fields = ('status',)
+    actions = [make_status_action(status, name) for status, name in STATE_CHOICES if allowed_sources(status)]
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ('product', 'shop', 'quantity', 'price')
+    raw_id_fields = ('product', 'shop')
+    extra = 0
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'dt', 'status', 'total_sum', 'archived_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    raw_id_fields = ('user', 'contact')
+    inlines = (ArchivedOrderItemInline,)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(LargeTableAdmin):
+    list_display = ('id', 'topic', 'created_at', 'processed_at')
+    list_filter = ('topic',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(PriceImport)
+class PriceImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'shop', 'status', 'created_at', 'finished_at')
+    list_select_related = ('user', 'shop')
+    list_filter = ('status',)
+    raw_id_fields = ('user', 'shop')
 
 @admin.register(Contact)
 class ContactAdmin(admin.ModelAdmin):
-    pass
+    raw_id_fields = ('user',)
 
 
 # @admin.register(ConfirmEmailToken)
@@ -0,0 +1,76 @@
+from django.db import connection
+from django.db.models import Sum
+
+from shop_inter.models import Order, OrderItem, Product, SubOrder, ShopSalesDaily, ProductSalesDaily, \
+    CategorySalesDaily
+
+# день продажи - дата создания заказа Order.dt, поэтому отмена и пересчет попадают в тот же день.
+# Выручка считается по ценам, зафиксированным в позициях при оформлении (price_order)
+SHOP_SQL = """
+    INSERT INTO {shop_sales} AS t (day, shop_id, orders, revenue, delivery)
+    SELECT o.dt::date, s.shop_id, COUNT(*) * %(sign)s, SUM(s.subtotal) * %(sign)s, SUM(s.delivery_cost) * %(sign)s
+    FROM {sub_order} s
+    JOIN {order} o ON o.id = s.order_id
+    WHERE s.order_id = ANY(%(order_ids)s)
+    GROUP BY 1, 2
+    ON CONFLICT (day, shop_id) DO UPDATE
+    SET orders = t.orders + EXCLUDED.orders,
+        revenue = t.revenue + EXCLUDED.revenue,
+        delivery = t.delivery + EXCLUDED.delivery
+"""
+
+ITEMS_SQL = """
+    INSERT INTO {table} AS t (day, shop_id, {key}, quantity, revenue)
+    SELECT o.dt::date, i.shop_id, {source}, SUM(i.quantity) * %(sign)s, SUM(i.quantity * i.price) * %(sign)s
+    FROM {order_item} i
+    JOIN {order} o ON o.id = i.order_id
+    JOIN {product} p ON p.id = i.product_id
+    WHERE i.order_id = ANY(%(order_ids)s) AND i.price IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, shop_id, {key}) DO UPDATE
+    SET quantity = t.quantity + EXCLUDED.quantity,
+        revenue = t.revenue + EXCLUDED.revenue
+"""
+
+
+def tables():
+    return {
+        'shop_sales': ShopSalesDaily._meta.db_table,
+        'sub_order': SubOrder._meta.db_table,
+        'order': Order._meta.db_table,
+        'order_item': OrderItem._meta.db_table,
+        'product': Product._meta.db_table,
+    }
+
+
+def record_sales(order_ids, sign=1):
+    """
+    Добавление оформленных заказов в дневные сводки продаж (sign=-1 - вычитание при отмене).
+    Три запроса INSERT ... ON CONFLICT на пачку заказов; вызывается в транзакции смены статуса
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    params = {'order_ids': order_ids, 'sign': sign}
+    names = tables()
+    with connection.cursor() as cursor:
+        cursor.execute(SHOP_SQL.format(**names), params)
+        cursor.execute(ITEMS_SQL.format(table=ProductSalesDaily._meta.db_table, key='product_id',
+                                        source='i.product_id', **names), params)
+        cursor.execute(ITEMS_SQL.format(table=CategorySalesDaily._meta.db_table, key='category_id',
+                                        source='p.category_id', **names), params)
+
+
+def shop_report(queryset):
+    """
+    Выручка магазинов по дням
+    """
+    return list(queryset.order_by('day', 'shop_id').values('day', 'shop_id', 'orders', 'revenue', 'delivery'))
+
+
+def top_report(queryset, key, limit):
+    """
+    Продукты или категории за период, по убыванию выручки
+    """
+    return list(queryset.values(key).annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by(
+        '-revenue', key)[:limit])
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ShopInterConfig(AppConfig):
     name = 'shop_inter'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,80 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from shop_inter.models import Parameter, Category
+
+
+class NameCache:
+    """
+    Локальный для процесса справочник id <-> name небольшой таблицы.
+    Версия справочника хранится в общем кеше, при её смене справочник перечитывается целиком.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'name_cache:{model._meta.label_lower}'
+        self.version = None
+        self.checked = 0
+        self.by_id = {}
+        self.by_name = {}
+
+    def _sync(self):
+        now = time.monotonic()
+        if self.version is not None and now - self.checked < settings.NAME_CACHE_CHECK_INTERVAL:
+            return
+        self.checked = now
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, None)
+            version = cache.get(self.version_key)
+        if version != self.version:
+            by_id = dict(self.model.objects.values_list('id', 'name'))
+            self.by_name = {name: pk for pk, name in by_id.items()}
+            self.by_id = by_id
+            self.version = version
+
+    def get_version(self):
+        self._sync()
+        return self.version
+
+    def _remember(self, pk, name):
+        self.by_id[pk] = name
+        self.by_name[name] = pk
+
+    def get_name(self, pk):
+        self._sync()
+        if pk not in self.by_id:
+            name = self.model.objects.filter(id=pk).values_list('name', flat=True).first()
+            if name is None:
+                return None
+            self._remember(pk, name)
+        return self.by_id[pk]
+
+    def get_id(self, name):
+        """
+        Возвращает id записи по имени, при отсутствии создает её
+        """
+        self._sync()
+        if name not in self.by_name:
+            obj, _ = self.model.objects.get_or_create(name=name)
+            self._remember(obj.id, obj.name)
+        return self.by_name[name]
+
+    def ensure(self, pk, name):
+        """
+        Проверяет наличие записи с заданными id и именем, при отсутствии создает её
+        """
+        if self.get_name(pk) != name:
+            self.model.objects.get_or_create(id=pk, name=name)
+            self._remember(pk, name)
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid4().hex, None)
+        self.version = None
+
+
+parameter_cache = NameCache(Parameter)
+category_cache = NameCache(Category)
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import Sum, F, Max, DecimalField, Exists, OuterRef, Subquery
+
+from shop_inter.models import OrderItem, SubOrder, ProductInfo
+
+
+class UnavailableItems(Exception):
+    """
+    В заказе есть позиции, которых магазин больше не предлагает; items - их продукты и магазины
+    """
+
+    def __init__(self, items):
+        super().__init__(f'Недоступных позиций: {len(items)}')
+        self.items = items
+
+
+def delivery_cost(subtotal, delivery_price, free_delivery_from):
+    """
+    Стоимость доставки по тарифу магазина
+    """
+    if free_delivery_from is not None and subtotal >= free_delivery_from:
+        return 0
+    return delivery_price
+
+
+def unavailable_items(order_id):
+    """
+    Позиции заказа без предложения магазина
+    """
+    offers = ProductInfo.objects.filter(product_id=OuterRef('product_id'), shop_id=OuterRef('shop_id'))
+    return list(OrderItem.objects.filter(order_id=order_id).filter(~Exists(offers)).order_by('id').values(
+        'product_id', 'shop_id', name=F('product__name')))
+
+
+def price_order(order_id, strict=True):
+    """
+    Расчет заказа при оформлении: в позиции записывается текущая цена предложения, затем позиции
+    группируются по магазинам одним запросом и для каждого магазина сохраняется подзаказ с суммой
+    и стоимостью доставки.
+    Если у позиции нет предложения магазина, заказ не рассчитывается (UnavailableItems);
+    strict=False - такие позиции пропускаются, для пересчета старых заказов
+    """
+    if strict:
+        missing = unavailable_items(order_id)
+        if missing:
+            raise UnavailableItems(missing)
+
+    offer_price = ProductInfo.objects.filter(
+        product_id=OuterRef('product_id'), shop_id=OuterRef('shop_id')).values('price')[:1]
+    with transaction.atomic():
+        # цена фиксируется в позициях: сводки продаж и отмена считают по ней, а не по текущему прайсу
+        OrderItem.objects.filter(order_id=order_id).update(price=Subquery(offer_price))
+        rows = OrderItem.objects.filter(order_id=order_id, price__isnull=False).values('shop_id').annotate(
+            subtotal=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+            delivery_price=Max('shop__delivery_price'),
+            free_delivery_from=Max('shop__free_delivery_from')).order_by()
+
+        sub_orders = [SubOrder(order_id=order_id,
+                               shop_id=row['shop_id'],
+                               subtotal=row['subtotal'],
+                               delivery_cost=delivery_cost(row['subtotal'], row['delivery_price'],
+                                                           row['free_delivery_from']))
+                      for row in rows]
+        SubOrder.objects.filter(order_id=order_id).delete()
+        SubOrder.objects.bulk_create(sub_orders)
+    return sub_orders
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken, get_password_reset_token_expiry_time
+
+from shop_inter.models import ConfirmEmailToken, Order
+from shop_inter.task_metrics import metrics_client
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'cleanup:metrics'
+JOBS_KEY = f'{METRICS_KEY}:jobs'
+
+
+def cleanup_jobs():
+    """
+    Устаревшие записи: имя задачи очистки -> queryset.
+    Токены авторизации DRF не удаляются: вход возвращает один и тот же токен, у него есть только время
+    создания, и удаление по нему разлогинило бы активных пользователей
+    """
+    now = timezone.now()
+    return {
+        'confirm_email_tokens': ConfirmEmailToken.objects.filter(
+            created_at__lt=now - timedelta(hours=settings.CONFIRM_EMAIL_TOKEN_TTL)),
+        'password_reset_tokens': ResetPasswordToken.objects.filter(
+            created_at__lt=now - timedelta(hours=get_password_reset_token_expiry_time())),
+        # корзина считается брошенной, если ее давно не меняли; позиции удаляются каскадно
+        'stale_baskets': Order.objects.filter(status='basket',
+                                              dt__lt=now - timedelta(days=settings.STALE_BASKET_DAYS)),
+    }
+
+
+def delete_in_batches(queryset, batch_size=None, max_batches=None):
+    """
+    Удаление записей queryset пачками по первичному ключу, не больше max_batches пачек за запуск.
+    Условия queryset проверяются повторно при удалении, поэтому запись, обновленная между выборкой
+    и удалением, остается. Возвращает число удаленных строк по моделям, включая каскадные
+    """
+    batch_size = batch_size or settings.CLEANUP_BATCH
+    max_batches = max_batches or settings.CLEANUP_MAX_BATCHES
+    deleted = Counter()
+    for _ in range(max_batches):
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted.update(queryset.filter(pk__in=ids).delete()[1])
+        if len(ids) < batch_size:
+            break
+    return dict(deleted)
+
+
+def run_cleanup():
+    """
+    Запуск всех задач очистки, ошибка одной не мешает остальным
+    """
+    results = {}
+    for name, queryset in cleanup_jobs().items():
+        started = time.monotonic()
+        try:
+            deleted = delete_in_batches(queryset)
+        except Exception as error:
+            logger.warning('Очистка %s прервана: %s', name, error)
+            continue
+        results[name] = deleted
+        record_metrics(name, deleted, time.monotonic() - started)
+    return results
+
+
+def record_metrics(name, deleted, duration):
+    """
+    Последний запуск задачи очистки в redis: удаленные строки по моделям и длительность, плюс общий счетчик строк
+    """
+    client = metrics_client()
+    if client is None:
+        return
+    key = f'{METRICS_KEY}:{name}'
+    pipe = client.pipeline(transaction=False)
+    pipe.sadd(JOBS_KEY, name)
+    pipe.hset(key, mapping={'deleted': json.dumps(deleted), 'duration': duration, 'finished_at': time.time()})
+    pipe.hincrby(key, 'total_rows', sum(deleted.values()))
+    try:
+        pipe.execute()
+    except Exception as error:
+        logger.warning('Не удалось сохранить метрики очистки: %s', error)
+
+
+def stats():
+    client = metrics_client()
+    if client is None:
+        return {}
+    names = sorted(client.smembers(JOBS_KEY))
+    pipe = client.pipeline(transaction=False)
+    for name in names:
+        pipe.hgetall(f'{METRICS_KEY}:{name}')
+    return {name: {
+        'deleted': json.loads(fields.get('deleted', '{}')),
+        'duration': float(fields.get('duration', 0)),
+        'finished_at': float(fields['finished_at']) if 'finished_at' in fields else None,
+        'total_rows': int(fields.get('total_rows', 0)),
+    } for name, fields in zip(names, pipe.execute())}
@@ -0,0 +1,65 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+
+from shop_inter.cache import category_cache, parameter_cache
+from shop_inter.models import ProductInfo, Category, Shop
+
+
+def make_etag(request, *parts):
+    """
+    ETag из адреса запроса, формата ответа и версии данных
+    """
+    key = '|'.join(str(part) for part in (request.get_full_path(), request.accepted_renderer.format) + parts)
+    return md5(key.encode('utf-8')).hexdigest()
+
+
+STAMP_KEY = 'catalog:stamp'
+
+
+def offers_stamp():
+    stamp = ProductInfo.objects.filter(shop__state=True).aggregate(
+        count=Count('id'), last_id=Max('id'), last_update=Max('updated_at'))
+    shops = list(Shop.objects.filter(state=True).values_list('id', flat=True))
+    return stamp['count'], stamp['last_id'], stamp['last_update'], shops
+
+
+def catalog_stamp():
+    """
+    Признаки версии активного каталога: меняются при любом изменении предложений, магазинов и справочников.
+    Часть по предложениям считается агрегатом по всей таблице, поэтому хранится в кеше
+    до invalidate_catalog, но не дольше CATALOG_STAMP_TTL
+    """
+    stamp = cache.get(STAMP_KEY)
+    if stamp is None:
+        stamp = offers_stamp()
+        cache.set(STAMP_KEY, stamp, settings.CATALOG_STAMP_TTL)
+    return tuple(stamp) + (category_cache.get_version(), parameter_cache.get_version())
+
+
+def invalidate_catalog():
+    """
+    Сброс признаков каталога после изменения предложений или магазинов, при вызове в транзакции - после ее фиксации
+    """
+    transaction.on_commit(lambda: cache.delete(STAMP_KEY))
+
+
+def catalog_version():
+    return md5('|'.join(str(part) for part in catalog_stamp()).encode('utf-8')).hexdigest()[:16]
+
+
+def products_etag(request, *args, **kwargs):
+    return make_etag(request, *catalog_stamp())
+
+
+def categories_etag(request, *args, **kwargs):
+    stamp = Category.objects.aggregate(count=Count('id'), last_id=Max('id'))
+    return make_etag(request, stamp['count'], stamp['last_id'], category_cache.get_version())
+
+
+def shops_etag(request, *args, **kwargs):
+    # таблица магазинов небольшая, поэтому берем все видимые в ответе поля
+    return make_etag(request, list(Shop.objects.values_list('id', 'name', 'state')))
@@ -0,0 +1,169 @@
+import csv
+import glob
+import io
+import os
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+
+from shop_inter.cache import parameter_cache, category_cache
+from shop_inter.fast_serializers import price_to_str
+from shop_inter.models import ProductInfo, ProductParameter, Parameter
+from shop_inter.renderers import dumps
+from shop_inter.routers import read_from
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ('id', 'external_id', 'model', 'name', 'category_id', 'category', 'shop_id', 'shop', 'quantity',
+           'price', 'price_rrc')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available_formats():
+    return [export_format for export_format in CONTENT_TYPES if export_format != 'parquet' or pyarrow is not None]
+
+
+def parameter_names():
+    """
+    Имена параметров - дополнительные столбцы для табличных форматов
+    """
+    return list(Parameter.objects.order_by('name').values_list('name', flat=True))
+
+
+def iter_batches(batch_size=None):
+    """
+    Активный каталог пачками словарей. Предложения читаются курсором на стороне сервера,
+    параметры - одним запросом на пачку, поэтому память не зависит от размера каталога
+    """
+    batch_size = batch_size or settings.EXPORT_BATCH
+    rows = ProductInfo.objects.filter(shop__state=True).order_by('id').values_list(
+        'id', 'external_id', 'model', 'product__name', 'product__category_id', 'shop_id', 'shop__name',
+        'quantity', 'price', 'price_rrc').iterator(chunk_size=batch_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield with_parameters(batch)
+            batch = []
+    if batch:
+        yield with_parameters(batch)
+
+
+def with_parameters(batch):
+    parameters = defaultdict(dict)
+    for product_id, parameter_id, value in ProductParameter.objects.filter(
+            product_id__in=[row[0] for row in batch]).order_by('id').values_list(
+            'product_id', 'parameter_id', 'value'):
+        parameters[product_id][parameter_cache.get_name(parameter_id)] = value
+
+    return [{
+        'id': offer_id,
+        'external_id': external_id,
+        'model': model,
+        'name': name,
+        'category_id': category_id,
+        'category': category_cache.get_name(category_id),
+        'shop_id': shop_id,
+        'shop': shop,
+        'quantity': quantity,
+        'price': price_to_str(price),
+        'price_rrc': price_to_str(price_rrc),
+        'parameters': parameters[offer_id],
+    } for offer_id, external_id, model, name, category_id, shop_id, shop, quantity, price, price_rrc in batch]
+
+
+def write_csv(batches, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS + tuple(names))
+    yield buffer.getvalue().encode('utf-8')
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for item in batch:
+            writer.writerow([item[column] for column in COLUMNS] +
+                            [item['parameters'].get(name, '') for name in names])
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_ndjson(batches):
+    for batch in batches:
+        yield b''.join(dumps(item) + b'\n' for item in batch)
+
+
+def write_parquet(batches, names, path):
+    """
+    Parquet пишется группами строк по пачке, формат требует файла, поэтому только в снимок
+    """
+    price = pyarrow.decimal128(20, 2)
+    schema = pyarrow.schema(
+        [('id', pyarrow.int64()), ('external_id', pyarrow.int64()), ('model', pyarrow.string()),
+         ('name', pyarrow.string()), ('category_id', pyarrow.int64()), ('category', pyarrow.string()),
+         ('shop_id', pyarrow.int64()), ('shop', pyarrow.string()), ('quantity', pyarrow.int64()),
+         ('price', price), ('price_rrc', price)] +
+        [(name, pyarrow.string()) for name in names])
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            columns = {column: [item[column] for item in batch] for column in COLUMNS}
+            for column in ('price', 'price_rrc'):
+                columns[column] = [None if value is None else Decimal(value) for value in columns[column]]
+            for name in names:
+                columns[name] = [item['parameters'].get(name) for item in batch]
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+
+def stream(export_format, alias=None):
+    """
+    Потоковая выгрузка каталога в csv или ndjson
+    """
+    # поток читается уже после выхода из представления, поэтому база для чтения задается явно
+    with read_from(alias):
+        if export_format == 'csv':
+            yield from write_csv(iter_batches(), parameter_names())
+        else:
+            yield from write_ndjson(iter_batches())
+
+
+def snapshot_path(export_format, version):
+    return os.path.join(settings.EXPORT_DIR, f'catalog-{version}.{export_format}')
+
+
+def write_file(export_format, path):
+    if export_format == 'parquet':
+        write_parquet(iter_batches(), parameter_names(), path)
+        return
+    with open(path, 'wb') as file:
+        for chunk in stream(export_format):
+            file.write(chunk)
+
+
+def build_snapshot(export_format, version):
+    """
+    Снимок каталога версии version. Файл появляется под своим именем только целиком,
+    снимки прежних версий удаляются
+    """
+    path = snapshot_path(export_format, version)
+    if os.path.exists(path):
+        return path
+    os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write_file(export_format, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    for old_path in glob.glob(os.path.join(settings.EXPORT_DIR, f'catalog-*.{export_format}')):
+        if old_path != path:
+            os.remove(old_path)
+    return path
@@ -0,0 +1,154 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import F
+
+from shop_inter.cache import parameter_cache, category_cache
+from shop_inter.models import ProductParameter, Contact, OrderItem
+
+PRICE_QUANT = Decimal('0.01')
+
+
+def price_to_str(value):
+    """
+    Цена в том же виде, что отдает DecimalField из DRF
+    """
+    if value is None:
+        return None
+    return '{:f}'.format(Decimal(value).quantize(PRICE_QUANT))
+
+
+class FastSerializer(ABC):
+    """
+    Сериализатор только для чтения, который собирает словари напрямую из строк .values()
+    Выдает тот же JSON, что и соответствующий ModelSerializer
+    """
+
+    def __init__(self, instance, many=False):
+        self.instance = instance
+        self.many = many
+
+    @abstractmethod
+    def to_list(self, queryset):
+        """
+        Список словарей по queryset, запросов не больше фиксированного числа на весь список
+        """
+
+    @property
+    def data(self):
+        if self.many:
+            return self.to_list(self.instance.prefetch_related(None))
+        items = self.to_list(self.instance.prefetch_related(None)[:1])
+        return items[0] if items else None
+
+
+class FastProductInfoSerializer(FastSerializer):
+    """
+    Аналог ProductInfoSerializer
+    """
+
+    def to_list(self, queryset):
+        rows = list(queryset.values('id', 'model', 'product__name', 'product__category_id', 'shop_id',
+                                    'quantity', 'price', 'price_rrc'))
+        parameters = defaultdict(list)
+        for product_id, parameter_id, value in ProductParameter.objects.filter(
+                product_id__in=[row['id'] for row in rows]).order_by('id').values_list(
+                'product_id', 'parameter_id', 'value'):
+            parameters[product_id].append({'parameter': parameter_cache.get_name(parameter_id), 'value': value})
+
+        return [{
+            'id': row['id'],
+            'model': row['model'],
+            'product': {
+                'name': row['product__name'],
+                'category': category_cache.get_name(row['product__category_id']),
+            },
+            'shop': row['shop_id'],
+            'quantity': row['quantity'],
+            'price': price_to_str(row['price']),
+            'price_rrc': price_to_str(row['price_rrc']),
+            'product_parameters': parameters[row['id']],
+        } for row in rows]
+
+
+class FastOrderItemSerializer(FastSerializer):
+    """
+    Аналог OrderItemSerializer
+    """
+
+    def to_list(self, queryset):
+        return [{
+            'id': row['id'],
+            'product': row['product_id'],
+            'shop': row['shop_id'],
+            'quantity': row['quantity'],
+        } for row in queryset.values('id', 'product_id', 'shop_id', 'quantity')]
+
+
+class FastOrderSerializer(FastSerializer):
+    """
+    Аналог OrderSerializer, queryset должен содержать аннотацию total_sum
+    """
+    contact_fields = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+    def to_list(self, queryset):
+        rows = list(queryset.values('id', 'status', 'dt', 'total_sum', 'contact_id'))
+        order_ids = [row['id'] for row in rows]
+
+        orderitems = defaultdict(list)
+        for order_id, orderitem_id in OrderItem.objects.filter(
+                order_id__in=order_ids).order_by('id').values_list('order_id', 'id'):
+            orderitems[order_id].append(orderitem_id)
+
+        contacts = self.load_contacts(rows)
+
+        return [{
+            'id': row['id'],
+            'orderitems': orderitems[row['id']],
+            'status': row['status'],
+            'dt': self.dt_to_str(row['dt']),
+            'total_sum': None if row['total_sum'] is None else int(row['total_sum']),
+            'contact': contacts.get(row['contact_id']),
+        } for row in rows]
+
+    def load_contacts(self, rows):
+        return {contact['id']: contact for contact in Contact.objects.filter(
+            id__in={row['contact_id'] for row in rows if row['contact_id']}).values(*self.contact_fields)}
+
+    @staticmethod
+    def dt_to_str(value):
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+
+class FastPartnerOrderSerializer(FastOrderSerializer):
+    """
+    Заказ глазами поставщика: только его позиции, сумма и доставка из его подзаказа.
+    Принимает queryset подзаказов
+    """
+
+    def to_list(self, queryset):
+        rows = list(queryset.values('order_id', 'shop_id', 'order__status', 'order__dt', 'subtotal',
+                                    'delivery_cost', contact_id=F('order__contact_id')))
+
+        orderitems = defaultdict(list)
+        for order_id, shop_id, orderitem_id in OrderItem.objects.filter(
+                order_id__in={row['order_id'] for row in rows},
+                shop_id__in={row['shop_id'] for row in rows}).order_by('id').values_list(
+                'order_id', 'shop_id', 'id'):
+            orderitems[order_id, shop_id].append(orderitem_id)
+
+        contacts = self.load_contacts(rows)
+
+        return [{
+            'id': row['order_id'],
+            'orderitems': orderitems[row['order_id'], row['shop_id']],
+            'status': row['order__status'],
+            'dt': self.dt_to_str(row['order__dt']),
+            'total_sum': int(row['subtotal']),
+            'delivery_cost': price_to_str(row['delivery_cost']),
+            'contact': contacts.get(row['contact_id']),
+        } for row in rows]
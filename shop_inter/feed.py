@@ -0,0 +1,136 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+
+from shop_inter.models import SubOrder
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'shop_inter:new_orders'
+
+
+def use_redis():
+    return redis is not None and bool(settings.ORDER_FEED_REDIS_URL)
+
+
+class OrderFeed:
+    """
+    Раздача событий о новых заказах ожидающим запросам процесса.
+    На процесс одна подписка на канал redis, события хранятся в кольцевом буфере
+    как (id подзаказа, id магазина, id заказа)
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=settings.ORDER_FEED_BUFFER)
+        self.listener = None
+        self.client = None
+
+    def push(self, events):
+        with self.condition:
+            self.events.extend(tuple(event) for event in events)
+            self.condition.notify_all()
+
+    def publish(self, events):
+        """
+        Публикация событий для всех процессов через redis.
+        Без redis публиковать некуда: ожидающие запросы сами опрашивают базу (poll)
+        """
+        if not events or not use_redis():
+            return
+        if self.client is None:
+            self.client = redis.Redis.from_url(settings.ORDER_FEED_REDIS_URL)
+        self.client.publish(CHANNEL, json.dumps(events))
+
+    def listen(self):
+        client = redis.Redis.from_url(settings.ORDER_FEED_REDIS_URL)
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    self.push(json.loads(message['data']))
+            except redis.RedisError as error:
+                logger.warning('Потеряна подписка на ленту заказов: %s', error)
+                time.sleep(1)
+
+    def start(self):
+        if self.listener is not None or not use_redis():
+            return
+        with self.condition:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='order-feed', daemon=True)
+                self.listener.start()
+
+    def wait(self, shop_ids, after, timeout):
+        """
+        Ждет до timeout секунд события магазинов shop_ids с id подзаказа больше after.
+        Возвращает id найденных подзаказов
+        """
+        if not use_redis():
+            return self.poll(shop_ids, after, timeout)
+        self.start()
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                found = [sub_order_id for sub_order_id, shop_id, _ in self.events
+                         if shop_id in shop_ids and sub_order_id > after]
+                remaining = deadline - time.monotonic()
+                if found or remaining <= 0:
+                    return sorted(found)
+                self.condition.wait(remaining)
+
+
+    @staticmethod
+    def poll(shop_ids, after, timeout):
+        """
+        Ожидание без redis: опрос базы раз в ORDER_FEED_POLL_INTERVAL секунд,
+        между опросами соединение с базой не удерживается
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            found = list(SubOrder.objects.filter(shop_id__in=shop_ids, id__gt=after).order_by('id').values_list(
+                'id', flat=True)[:settings.ORDER_FEED_BUFFER])
+            connection.close()
+            remaining = deadline - time.monotonic()
+            if found or remaining <= 0:
+                return found
+            time.sleep(min(settings.ORDER_FEED_POLL_INTERVAL, remaining))
+
+
+order_feed = OrderFeed()
+
+# SSE соединение и ожидающий long-poll занимают поток веб-сервера целиком, поэтому их число в процессе ограничено
+stream_slots = threading.BoundedSemaphore(settings.ORDER_FEED_MAX_STREAMS)
+
+
+class SlotStream:
+    """
+    Содержимое потока SSE, занимающее слот stream_slots, пока сервер не закроет ответ
+    """
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.released = False
+
+    def __iter__(self):
+        return self.iterator
+
+    def close(self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            self.iterator.close()
+        finally:
+            stream_slots.release()
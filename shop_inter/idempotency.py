@@ -0,0 +1,92 @@
+from datetime import timedelta
+from functools import wraps
+from hashlib import sha256
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.http import JsonResponse, HttpResponse
+from django.utils import timezone
+
+from shop_inter.models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+
+def _reserve(user_id, key, fingerprint):
+    """
+    Занимаем ключ за текущим запросом.
+    Возвращает (запись, None) для нового ключа или (None, ответ) для повтора.
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user_id=user_id, key=key, request=fingerprint), None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+    if record is None:
+        # ключ удален после ошибки - выполняем запрос заново
+        return _reserve(user_id, key, fingerprint)
+    now = timezone.now()
+    expired = record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    # запрос, занявший ключ, не завершился за IDEMPOTENCY_LEASE (процесс упал) - ключ освобождается
+    abandoned = record.status_code is None and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LEASE)
+    if expired or abandoned:
+        # удаляем именно эту запись: параллельный повтор мог уже занять ключ заново
+        IdempotencyKey.objects.filter(id=record.id).delete()
+        return _reserve(user_id, key, fingerprint)
+    if record.request != fingerprint:
+        return None, JsonResponse({'Status': False, 'Errors': 'Ключ уже использован для другого запроса'},
+                                  status=422)
+    if record.status_code is None:
+        return None, JsonResponse({'Status': False, 'Errors': 'Запрос с этим ключом еще выполняется'},
+                                  status=409)
+    response = HttpResponse(bytes(record.content), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return None, response
+
+
+def fingerprint(request):
+    """
+    Метод, путь и хеш тела запроса: тот же ключ с другим телом - ошибка клиента, а не повтор
+    """
+    try:
+        body = request.body
+    except RawPostDataException:
+        # тело уже прочитано потоком (multipart) - хешируем разобранные поля
+        body = repr(sorted((name, str(value)) for name, value in request.data.items())).encode('utf-8')
+    return f'{request.method} {request.path[:180]} {sha256(body).hexdigest()}'
+
+
+def idempotent(method):
+    """
+    Декоратор метода представления: при заголовке Idempotency-Key первый ответ сохраняется
+    и возвращается на повторные запросы с тем же ключом в течение IDEMPOTENCY_KEY_TTL
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key or not request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'Status': False, 'Errors': 'Слишком длинный Idempotency-Key'}, status=400)
+
+        record, replay = _reserve(request.user.id, key, fingerprint(request))
+        if replay is not None:
+            return replay
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500 or response.streaming or not getattr(response, 'is_rendered', True):
+            record.delete()
+            return response
+        record.status_code = response.status_code
+        record.content_type = response.get('Content-Type', '')
+        record.content = response.content
+        record.save(update_fields=['status_code', 'content_type', 'content'])
+        return response
+    return wrapper
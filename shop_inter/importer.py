@@ -0,0 +1,263 @@
+import asyncio
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from requests import get
+from yaml import load as load_yaml, Loader
+
+from shop_inter.cache import parameter_cache, category_cache
+from shop_inter.etags import invalidate_catalog
+from shop_inter.models import Shop, ProductInfo, Product, ProductParameter, PriceHistory
+from shop_inter.offers import refresh_best_offers
+from shop_inter.outbox import publish
+from shop_inter.validation import validate_price, FeedValidationError, MAX_INTEGER
+
+
+DELTA_FIELDS = ('price', 'price_rrc', 'quantity')
+MAX_PRICE = Decimal('1e18')
+
+
+def parse_price(stream):
+    return load_yaml(stream, Loader=Loader)
+
+
+def fetch_price(url):
+    """
+    Загружаем и разбираем yaml файл прайса поставщика
+    """
+    stream = get(url, timeout=settings.SHOP_REFRESH_TIMEOUT).content
+    return parse_price(stream)
+
+
+async def _fetch_all(urls):
+    limit = asyncio.Semaphore(settings.SHOP_REFRESH_CONCURRENCY)
+    host_locks = defaultdict(asyncio.Lock)
+    host_next = {}
+
+    async def fetch(client, url):
+        try:
+            host = urlparse(url).hostname
+        except ValueError as error:
+            return None, error, 0.0
+        async with host_locks[host]:
+            # не чаще одного запроса к серверу поставщика в SHOP_REFRESH_HOST_DELAY секунд
+            delay = host_next.get(host, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with limit:
+                started = time.monotonic()
+                try:
+                    # таймаут клиента ограничивает каждую операцию, а не весь ответ медленного сервера
+                    response = await asyncio.wait_for(client.get(url), settings.SHOP_REFRESH_TIMEOUT)
+                    response.raise_for_status()
+                    result = response.content, None
+                except asyncio.TimeoutError:
+                    result = None, TimeoutError(f'Прайс не загружен за {settings.SHOP_REFRESH_TIMEOUT} с')
+                except Exception as error:
+                    # неверная ссылка из админки (httpx.InvalidURL) и любая другая ошибка -
+                    # ошибка этого магазина, остальные прайсы пачки загружаются
+                    result = None, error
+                elapsed = time.monotonic() - started
+            host_next[host] = time.monotonic() + settings.SHOP_REFRESH_HOST_DELAY
+        return result + (elapsed,)
+
+    async with httpx.AsyncClient(timeout=settings.SHOP_REFRESH_TIMEOUT) as client:
+        return await asyncio.gather(*(fetch(client, url) for url in urls))
+
+
+def fetch_prices(urls):
+    """
+    Параллельная загрузка прайсов асинхронным клиентом.
+    Возвращает список (содержимое, ошибка, время загрузки) в порядке urls
+    """
+    return asyncio.run(_fetch_all(urls))
+
+
+def import_price(data, user_id, url=None, notify=False):
+    """
+    Импорт прайса поставщика в каталог одной транзакцией после проверки всего прайса.
+    Справочники категорий и параметров пополняются до нее, чтобы кеш имен не ссылался на откаченные записи.
+    notify - письмо поставщику о загрузке, только для загрузок по его запросу, не для планировщика
+    """
+    report = validate_price(data)
+    if not report['valid']:
+        raise FeedValidationError(report)
+
+    for category in data['categories']:
+        category_cache.ensure(category['id'], category['name'])
+    parameter_ids = {name: parameter_cache.get_id(name)
+                     for item in data['goods'] for name in item['parameters']}
+
+    with transaction.atomic():
+        shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+        if url and shop.url != url:
+            # запоминаем ссылку, чтобы планировщик обновлял прайс сам
+            Shop.objects.filter(id=shop.id).update(url=url)
+        shop.category_set.add(*[category['id'] for category in data['categories']])
+        old_prices = {product_id: (price, price_rrc) for product_id, price, price_rrc in ProductInfo.objects.filter(
+            shop_id=shop.id).values_list('product_id', 'price', 'price_rrc')}
+        ProductInfo.objects.filter(shop_id=shop.id).delete()
+        history = []
+        for item in data['goods']:
+            product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'],
+                                                       model=item['model'])
+            price, price_rrc = Decimal(str(item['price'])), Decimal(str(item['price_rrc']))
+            old_price, old_price_rrc = old_prices.get(product.id, (None, None))
+            if price != old_price or price_rrc != old_price_rrc:
+                history.append(PriceHistory(product_id=product.id, shop_id=shop.id, category_id=item['category'],
+                                            price=price, price_rrc=price_rrc, old_price=old_price))
+
+            product_info = ProductInfo.objects.create(product_id=product.id,
+                                                      external_id=item['id'],
+                                                      model=item['model'],
+                                                      price=item['price'],
+                                                      price_rrc=item['price_rrc'],
+                                                      quantity=item['quantity'],
+                                                      shop_id=shop.id)
+            for name, value in item['parameters'].items():
+                ProductParameter.objects.create(product_id=product_info.id,
+                                                parameter_id=parameter_ids[name],
+                                                value=value)
+        PriceHistory.objects.bulk_create(history, batch_size=1000)
+        refresh_best_offers(set(old_prices) | set(ProductInfo.objects.filter(shop_id=shop.id).values_list(
+            'product_id', flat=True)))
+        invalidate_catalog()
+        if notify:
+            publish('price.imported', shop_id=shop.id, products=len(data['goods']))
+    return shop
+
+
+def parse_delta(item):
+    """
+    Проверка одного изменения от поставщика.
+    Возвращает (external_id, price, price_rrc, quantity), отсутствующие поля - None
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Ожидается объект')
+    external_id = item.get('external_id')
+    # в UPDATE ... FROM (VALUES ...) external_id приводится к integer, больший id уронил бы всю пачку
+    if not isinstance(external_id, int) or isinstance(external_id, bool) or not 0 <= external_id < MAX_INTEGER:
+        raise ValueError('Неверный external_id')
+    values = [external_id]
+    for field in ('price', 'price_rrc'):
+        value = item.get(field)
+        if value is not None:
+            try:
+                value = Decimal(str(value))
+            except InvalidOperation:
+                raise ValueError(f'Неверное значение {field}')
+            if not value.is_finite() or value < 0 or value >= MAX_PRICE or value.as_tuple().exponent < -2:
+                raise ValueError(f'Неверное значение {field}')
+        values.append(value)
+    quantity = item.get('quantity')
+    if quantity is not None and (not isinstance(quantity, int) or isinstance(quantity, bool) or
+                                 not 0 <= quantity < MAX_INTEGER):
+        raise ValueError('Неверное значение quantity')
+    values.append(quantity)
+    if all(value is None for value in values[1:]):
+        raise ValueError(f'Нужно хотя бы одно из полей {", ".join(DELTA_FIELDS)}')
+    return tuple(values)
+
+
+def collect_deltas(items):
+    """
+    Разбор пачки изменений: результаты в порядке items (ошибочные уже с Status и Error)
+    и изменения по external_id; при повторе external_id действует последнее значение
+    """
+    results = []
+    deltas = {}
+    for item in items:
+        try:
+            delta = parse_delta(item)
+        except ValueError as error:
+            results.append({'external_id': item.get('external_id') if isinstance(item, dict) else None,
+                            'Status': False, 'Error': str(error)})
+            continue
+        deltas[delta[0]] = delta
+        results.append({'external_id': delta[0]})
+    return results, deltas
+
+
+def ambiguous_external_ids(shop_id, external_ids):
+    """
+    external_id не уникален в базе: если у магазина несколько таких предложений, неясно, какое менять
+    """
+    return set(ProductInfo.objects.filter(shop_id=shop_id, external_id__in=list(external_ids)).values(
+        'external_id').annotate(offers=Count('id')).filter(offers__gt=1).order_by().values_list(
+        'external_id', flat=True))
+
+
+def finish_results(results, updated, ambiguous):
+    """
+    Итог по изменениям, прошедшим проверку: обновлено, неоднозначный external_id или предложение не найдено
+    """
+    for result in results:
+        if 'Status' not in result:
+            result['Status'] = result['external_id'] in updated
+            if result['external_id'] in ambiguous:
+                result['Error'] = 'У магазина несколько предложений с этим external_id'
+            elif not result['Status']:
+                result['Error'] = 'Предложение не найдено'
+    return results
+
+
+def apply_deltas(shop_id, items):
+    """
+    Изменение цен и остатков предложений магазина по external_id одним UPDATE ... FROM (VALUES ...).
+    external_id, которому соответствует несколько предложений магазина, не меняется и отмечается ошибкой.
+    Возвращает результат по каждому изменению в порядке items
+    """
+    results, deltas = collect_deltas(items)
+    if not deltas:
+        return results
+
+    table = ProductInfo._meta.db_table
+    product_table = Product._meta.db_table
+    with transaction.atomic():
+        ambiguous = ambiguous_external_ids(shop_id, deltas)
+        for external_id in ambiguous:
+            del deltas[external_id]
+
+        rows = []
+        if deltas:
+            values = ', '.join(['(%s::integer, %s::numeric, %s::numeric, %s::integer)'] * len(deltas))
+            # вторая ссылка на таблицу (old) видит строки до изменения - из нее берутся прежние цены для истории
+            sql = f"""
+                UPDATE {table} AS p
+                SET price = COALESCE(v.price, p.price),
+                    price_rrc = COALESCE(v.price_rrc, p.price_rrc),
+                    quantity = COALESCE(v.quantity, p.quantity),
+                    updated_at = %s
+                FROM (VALUES {values}) AS v (external_id, price, price_rrc, quantity)
+                JOIN {table} AS old ON old.external_id = v.external_id AND old.shop_id = %s
+                JOIN {product_table} AS product ON product.id = old.product_id
+                WHERE p.id = old.id
+                RETURNING p.external_id, p.product_id, product.category_id, p.price, p.price_rrc, p.quantity,
+                          old.price, old.price_rrc, old.quantity
+            """
+            params = [timezone.now()] + [value for delta in deltas.values() for value in delta] + [shop_id]
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        history = []
+        changed_products = set()
+        for _, product_id, category_id, price, price_rrc, quantity, old_price, old_price_rrc, old_quantity in rows:
+            price_changed = price != old_price or price_rrc != old_price_rrc
+            if price_changed:
+                history.append(PriceHistory(product_id=product_id, shop_id=shop_id, category_id=category_id,
+                                            price=price, price_rrc=price_rrc, old_price=old_price))
+            if price_changed or quantity != old_quantity:
+                changed_products.add(product_id)
+        PriceHistory.objects.bulk_create(history, batch_size=1000)
+        refresh_best_offers(changed_products)
+        if rows:
+            invalidate_catalog()
+
+    return finish_results(results, {row[0] for row in rows}, ambiguous)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from shop_inter.checkout import price_order
+from shop_inter.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Расчет подзаказов магазинов для оформленных заказов, у которых их нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        last_id = 0
+        while True:
+            order_ids = list(Order.objects.exclude(status='basket').filter(
+                id__gt=last_id, sub_orders__isnull=True).order_by('id').values_list(
+                'id', flat=True)[:options['batch']])
+            if not order_ids:
+                break
+            for order_id in order_ids:
+                price_order(order_id, strict=False)
+            last_id = order_ids[-1]
+            total += len(order_ids)
+        self.stdout.write(f'Рассчитано заказов: {total}')
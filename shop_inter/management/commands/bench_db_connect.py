@@ -0,0 +1,28 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Сравнение накладных расходов на подключение к БД: новое соединение на запрос и постоянное'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200)
+
+    def run(self, queries, reconnect):
+        connection.close()
+        started = perf_counter()
+        for _ in range(queries):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if reconnect:
+                connection.close()
+        return (perf_counter() - started) / queries
+
+    def handle(self, *args, **options):
+        fresh = self.run(options['queries'], reconnect=True)
+        persistent = self.run(options['queries'], reconnect=False)
+        self.stdout.write(f'новое соединение: {fresh * 1000:.2f} мс на запрос')
+        self.stdout.write(f'постоянное соединение: {persistent * 1000:.2f} мс на запрос')
+        self.stdout.write(f'накладные расходы на подключение: {(fresh - persistent) * 1000:.2f} мс')
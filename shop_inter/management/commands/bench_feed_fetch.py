@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from shop_inter.importer import fetch_price, fetch_prices
+
+
+class Command(BaseCommand):
+    help = ('Сравнение пропускной способности обработчиков запросов при медленном сервере прайсов: '
+            'загрузка прайса в обработчике (как в PartnerUpdate до очереди) и постановка в очередь '
+            'с загрузкой асинхронным клиентом в фоновой задаче')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=40, help='число запросов на загрузку прайса')
+        parser.add_argument('--workers', type=int, default=8, help='потоков веб-сервера')
+        parser.add_argument('--delay', type=float, default=1.0, help='задержка ответа сервера прайсов, с')
+
+    def handle(self, *args, **options):
+        delay = options['delay']
+
+        class SlowFeed(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(delay)
+                body = b'shop: test\ncategories: []\ngoods: []\n'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        # у каждого прайса свой адрес 127.0.0.x: к одному серверу поставщика прайсы загружаются по очереди
+        servers = [ThreadingHTTPServer((f'127.0.0.{number + 1}', 0), SlowFeed)
+                   for number in range(options['requests'])]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [f'http://{server.server_address[0]}:{server.server_port}/feed.yaml' for server in servers]
+        try:
+            # обработчик ждет ответа поставщика и держит поток веб-сервера
+            inline = self.serve(fetch_price, urls, options['workers'])
+
+            # обработчик ставит загрузку в очередь, прайсы загружает фоновая задача
+            queued_urls = []
+            queued = self.serve(queued_urls.append, urls, options['workers'])
+            with override_settings(SHOP_REFRESH_HOST_DELAY=0, SHOP_REFRESH_CONCURRENCY=len(urls)):
+                started = time.perf_counter()
+                fetch_prices(queued_urls)
+                loaded = time.perf_counter() - started
+        finally:
+            for server in servers:
+                server.shutdown()
+
+        self.stdout.write(f'запросов: {len(urls)}, потоков веб-сервера: {options["workers"]}, '
+                          f'задержка прайса: {delay} с')
+        self.report('загрузка в обработчике', *inline)
+        self.report('постановка в очередь', *queued)
+        self.stdout.write(f'  загрузка прайсов из очереди (httpx): {loaded:.2f} с')
+
+    @staticmethod
+    def serve(handler, urls, workers):
+        """
+        Обработка запросов пулом потоков, как воркером веб-сервера.
+        Возвращает общее время и время ответа каждого запроса с учетом ожидания свободного потока
+        """
+        started = time.perf_counter()
+
+        def request(url):
+            handler(url)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(workers) as pool:
+            latencies = list(pool.map(request, urls))
+        return time.perf_counter() - started, latencies
+
+    def report(self, title, elapsed, latencies):
+        self.stdout.write(f'{title}: {len(latencies) / elapsed:.1f} запросов/с, '
+                          f'ответ медиана {statistics.median(latencies):.2f} с, макс. {max(latencies):.2f} с')
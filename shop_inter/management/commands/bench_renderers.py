@@ -0,0 +1,37 @@
+import tracemalloc
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from shop_inter.fast_serializers import FastProductInfoSerializer
+from shop_inter.models import ProductInfo
+from shop_inter.renderers import FastJSONRenderer, stream_list, orjson
+
+
+class Command(BaseCommand):
+    help = 'Сравнение скорости и пикового потребления памяти при выдаче каталога в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, label, func, repeat):
+        tracemalloc.start()
+        started = perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = (perf_counter() - started) / repeat
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stdout.write(f'{label}: {elapsed * 1000:.1f} мс, пик памяти {peak / 2 ** 20:.1f} МБ')
+
+    def handle(self, *args, **options):
+        queryset = ProductInfo.objects.all()
+        self.stdout.write(f'Объектов: {queryset.count()}, orjson: {"да" if orjson else "нет"}')
+        data = FastProductInfoSerializer(queryset, many=True).data
+        self.measure('JSONRenderer', lambda: JSONRenderer().render(data), options['repeat'])
+        self.measure('FastJSONRenderer', lambda: FastJSONRenderer().render(data), options['repeat'])
+        self.measure('полный ответ', lambda: FastJSONRenderer().render(
+            FastProductInfoSerializer(queryset.all(), many=True).data), options['repeat'])
+        self.measure('потоковый ответ', lambda: sum(
+            len(chunk) for chunk in stream_list(FastProductInfoSerializer, queryset.all())), options['repeat'])
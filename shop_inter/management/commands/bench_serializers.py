@@ -0,0 +1,45 @@
+import json
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from shop_inter.fast_serializers import FastProductInfoSerializer, FastOrderSerializer
+from shop_inter.models import ProductInfo, Order
+from shop_inter.serializers import ProductInfoSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнение скорости обычных и быстрых сериализаторов (объектов в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        product_info = ProductInfo.objects.all()
+        orders = Order.objects.exclude(status='basket').with_total_sum()
+        cases = (
+            ('ProductInfo', ProductInfoSerializer,
+             product_info.select_related('product').prefetch_related('product_parameters'),
+             FastProductInfoSerializer, product_info),
+            ('Order', OrderSerializer, orders.select_related('contact').prefetch_related('ordered_items'),
+             FastOrderSerializer, orders),
+        )
+        renderer = JSONRenderer()
+        for name, slow, slow_queryset, fast, fast_queryset in cases:
+            count = fast_queryset.count()
+            if not count:
+                self.stdout.write(f'{name}: нет данных')
+                continue
+            slow_data = renderer.render(slow(slow_queryset.all(), many=True).data)
+            fast_data = renderer.render(fast(fast_queryset.all(), many=True).data)
+            if json.loads(slow_data) != json.loads(fast_data):
+                self.stdout.write(self.style.WARNING(f'{name}: результаты сериализаторов различаются'))
+            elif slow_data != fast_data:
+                self.stdout.write(self.style.WARNING(f'{name}: различается порядок элементов в JSON'))
+            for label, serializer, queryset in (('drf', slow, slow_queryset), ('fast', fast, fast_queryset)):
+                started = perf_counter()
+                for _ in range(options['repeat']):
+                    renderer.render(serializer(queryset.all(), many=True).data)
+                elapsed = perf_counter() - started
+                self.stdout.write(f'{name} {label}: {count * options["repeat"] / elapsed:.0f} объектов/с')
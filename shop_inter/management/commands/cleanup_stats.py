@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop_inter.cleanup import stats, run_cleanup
+
+
+class Command(BaseCommand):
+    help = 'Метрики очистки устаревших токенов и корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', action='store_true', help='Выполнить очистку перед выводом')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            run_cleanup()
+        for name, metrics in stats().items():
+            self.stdout.write(f'{name}: удалено {metrics["deleted"]} за {metrics["duration"]:.2f} с, '
+                              f'всего строк {metrics["total_rows"]}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop_inter.etags import catalog_version
+from shop_inter.export import available_formats, build_snapshot, write_file
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка активного каталога в файл или снимок для catalog/export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', default='csv')
+        parser.add_argument('--output', help='Путь к файлу; без него строится снимок текущей версии каталога')
+
+    def handle(self, *args, **options):
+        export_format = options['export_format']
+        if export_format not in available_formats():
+            raise CommandError(f'Доступные форматы: {", ".join(available_formats())}')
+        if options['output']:
+            write_file(export_format, options['output'])
+            path = options['output']
+        else:
+            path = build_snapshot(export_format, catalog_version())
+        self.stdout.write(f'Каталог выгружен: {path}')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from shop_inter.models import OrderItem, Order_to_Orderitem
+
+
+class Command(BaseCommand):
+    help = 'Перенос связей заказов с позициями из Order_to_Orderitem в поле OrderItem.order'
+
+    def handle(self, *args, **options):
+        item_table = connection.ops.quote_name(OrderItem._meta.db_table)
+        link_table = connection.ops.quote_name(Order_to_Orderitem._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {item_table} SET order_id = link.order_id '
+                f'FROM {link_table} AS link '
+                f'WHERE link.orderitem_id = {item_table}.id AND {item_table}.order_id IS NULL'
+            )
+            updated = cursor.rowcount
+        orphans = OrderItem.objects.filter(order__isnull=True).count()
+        self.stdout.write(f'Перенесено позиций: {updated}, позиций без заказа: {orphans}')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from shop_inter.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = ('Слияние лишних корзин пользователей в последнюю измененную. '
+            'Запускать до migrate, создающего ограничение one_basket_per_user')
+
+    def handle(self, *args, **options):
+        merged = 0
+        user_ids = list(Order.objects.filter(status='basket').values('user_id').annotate(
+            baskets=Count('id')).filter(baskets__gt=1).order_by().values_list('user_id', flat=True))
+        for user_id in user_ids:
+            with transaction.atomic():
+                baskets = list(Order.objects.select_for_update().filter(
+                    user_id=user_id, status='basket').order_by('-dt', '-id').values_list('id', flat=True))
+                keep, extra = baskets[0], baskets[1:]
+                kept = {(product_id, shop_id): item_id for item_id, product_id, shop_id in OrderItem.objects.filter(
+                    order_id=keep).values_list('id', 'product_id', 'shop_id')}
+                for item in OrderItem.objects.filter(order_id__in=extra).order_by('id'):
+                    key = (item.product_id, item.shop_id)
+                    if key in kept:
+                        # товар уже есть в оставшейся корзине - складываем количество
+                        OrderItem.objects.filter(id=kept[key]).update(quantity=F('quantity') + item.quantity)
+                        item.delete()
+                    else:
+                        OrderItem.objects.filter(id=item.id).update(order_id=keep)
+                        kept[key] = item.id
+                Order.objects.filter(id__in=extra).delete()
+                merged += len(extra)
+        self.stdout.write(f'Удалено лишних корзин: {merged}')
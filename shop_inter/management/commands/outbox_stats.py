@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop_inter.outbox import stats
+
+
+class Command(BaseCommand):
+    help = 'Метрики outbox: очередь, задержка и пропускная способность ретранслятора'
+
+    def handle(self, *args, **options):
+        for name, value in stats().items():
+            self.stdout.write(f'{name}: {value}')
@@ -0,0 +1,63 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shop_inter.analytics import record_sales
+from shop_inter.models import Order, ShopSalesDaily, ProductSalesDaily, CategorySalesDaily
+
+
+class Command(BaseCommand):
+    help = ('Пересчет дневных сводок продаж по заказам начиная с даты --since '
+            '(по умолчанию и не раньше - первый день, заказы которого еще не переносились в архив). '
+            'Каждый день пересчитывается в своей транзакции. '
+            'Заказы, оформленные во время пересчета, могут учесться дважды - запускать в спокойное время')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Дата в формате ГГГГ-ММ-ДД')
+        parser.add_argument('--batch', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # заказы старше срока уже могут быть в архиве, сводки за эти дни по ним не восстановить
+        earliest = (timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AGE)).date() + timedelta(days=1)
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('Неверно указана дата --since')
+            if since < earliest:
+                raise CommandError(f'Сводки раньше {earliest} содержат архивные заказы и не пересчитываются')
+        else:
+            since = earliest
+
+        total = 0
+        day = since
+        today = timezone.now().date()
+        while day <= today:
+            total += self.rebuild_day(day, options['batch'])
+            day += timedelta(days=1)
+        self.stdout.write(f'Учтено заказов: {total}')
+
+    @staticmethod
+    def rebuild_day(day, batch):
+        """
+        Удаление и повторный расчет сводок за один день в одной транзакции
+        """
+        start = datetime.combine(day, time.min)
+        orders = Order.objects.exclude(status__in=('basket', 'canceled')).filter(
+            dt__gte=start, dt__lt=start + timedelta(days=1))
+        total = 0
+        with transaction.atomic():
+            for model in (ShopSalesDaily, ProductSalesDaily, CategorySalesDaily):
+                model.objects.filter(day=day).delete()
+            last_id = 0
+            while True:
+                order_ids = list(orders.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch])
+                if not order_ids:
+                    break
+                record_sales(order_ids)
+                last_id = order_ids[-1]
+                total += len(order_ids)
+        return total
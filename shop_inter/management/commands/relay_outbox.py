@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop_inter.outbox import relay_batch
+
+
+class Command(BaseCommand):
+    help = 'Постоянная передача событий outbox в celery (альтернатива периодической задаче relay_outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=settings.OUTBOX_BATCH)
+        parser.add_argument('--once', action='store_true', help='Передать накопленные события и завершиться')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = relay_batch(options['batch'])
+            total += count
+            if count < options['batch']:
+                if options['once']:
+                    break
+                time.sleep(settings.OUTBOX_IDLE_SLEEP)
+        self.stdout.write(f'Передано событий: {total}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from shop_inter.task_metrics import render_prometheus
+
+
+class Command(BaseCommand):
+    help = 'Метрики задач celery и длины очередей в формате Prometheus'
+
+    def handle(self, *args, **options):
+        self.stdout.write(render_prometheus(), ending='')
@@ -1,4 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import Q, Sum, F, DecimalField
 from django.utils.translation import gettext_lazy as _
 
 
@@ -36,3 +38,26 @@ class UserManager(BaseUserManager):
             raise ValueError('Superuser must have is_superuser=True.')
 
         return self._create_user(email, password, **extra_fields)
+
+
+class OrderQuerySet(models.QuerySet):
+    """
+    Выборки заказов
+    """
+
+    def basket(self, user_id):
+        """
+        Корзина пользователя, создается при первом обращении. Вторую корзину не дает создать ограничение
+        one_basket_per_user: если параллельный запрос вставил корзину первым, get_or_create получает
+        IntegrityError и возвращает уже созданную
+        """
+        return self.get_or_create(user_id=user_id, status='basket')[0]
+
+    def with_total_sum(self):
+        """
+        Добавляет сумму заказа по ценам магазинов, из которых заказаны позиции
+        """
+        return self.annotate(total_sum=Sum(
+            F('ordered_items__quantity') * F('ordered_items__product__product_info__price'),
+            filter=Q(ordered_items__product__product_info__shop_id=F('ordered_items__shop_id')),
+            output_field=DecimalField()))
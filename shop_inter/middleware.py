@@ -0,0 +1,110 @@
+import re
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+from shop_inter.routers import choose_replica, set_read_alias, reset_read_alias
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+
+def compress_sequence(sequence):
+    compressor = brotli.Compressor()
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+        yield compressor.flush()
+    yield compressor.finish()
+
+
+class BrotliMiddleware(MiddlewareMixin):
+    """
+    Сжатие ответов brotli, если клиент его поддерживает и модуль brotli установлен.
+    Ставится в MIDDLEWARE после GZipMiddleware, чтобы brotli имел приоритет.
+    """
+
+    def process_response(self, request, response):
+        if brotli is None:
+            return response
+        if not response.streaming and len(response.content) < 200:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed_content = brotli.compress(response.content)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'br'
+        return response
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Безопасные запросы к представлениям с replica_reads = True читают из реплики.
+    После изменяющего запроса клиент на REPLICA_PIN_SECONDS закрепляется за основной базой,
+    чтобы сразу видеть свои изменения. Закрепление хранится в подписанной cookie, ее видит любой
+    процесс; клиентам без cookie с токеном - в общем кеше (CACHE_URL на redis)
+    """
+    pin_cookie = 'replica_pin'
+
+    @staticmethod
+    def pin_key(request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if not authorization:
+            return None
+        return 'replica_pin:' + md5(authorization.encode('utf-8')).hexdigest()
+
+    def is_pinned(self, request):
+        if request.get_signed_cookie(self.pin_cookie, default=None, salt=self.pin_cookie,
+                                     max_age=settings.REPLICA_PIN_SECONDS):
+            return True
+        key = self.pin_key(request)
+        return bool(key and cache.get(key))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if request.method not in SAFE_METHODS or not getattr(view_class, 'replica_reads', False):
+            return None
+        if self.is_pinned(request):
+            return None
+        alias = choose_replica()
+        if alias:
+            request._read_alias_token = set_read_alias(alias)
+        return None
+
+    def process_response(self, request, response):
+        token = getattr(request, '_read_alias_token', None)
+        if token is not None:
+            reset_read_alias(token)
+            del request._read_alias_token
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_signed_cookie(self.pin_cookie, '1', salt=self.pin_cookie,
+                                       max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+            key = self.pin_key(request)
+            if key:
+                cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
@@ -3,7 +3,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django_rest_passwordreset.tokens import get_token_generator
 
-from .manager import UserManager
+from .manager import UserManager, OrderQuerySet
 from django.utils.translation import gettext_lazy as _
 
 STATE_CHOICES = (
@@ -16,6 +16,23 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+# Допустимые переходы статусов заказа после оформления
+STATE_TRANSITIONS = {
+    'new': ('confirmed', 'canceled'),
+    'confirmed': ('assembled', 'canceled'),
+    'assembled': ('sent', 'canceled'),
+    'sent': ('delivered',),
+    'delivered': (),
+    'canceled': (),
+}
+
+IMPORT_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('done', 'Загружен'),
+    ('invalid', 'Отклонен проверкой'),
+    ('failed', 'Ошибка загрузки'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -66,6 +83,17 @@ class Shop(models.Model):
     filename = models.FileField(verbose_name='yaml file', blank=True)
     objects = models.Manager()
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    delivery_price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='стоимость доставки',
+                                         default=0)
+    free_delivery_from = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True,
+                                             verbose_name='бесплатная доставка от суммы')
+    refresh_interval = models.PositiveIntegerField(verbose_name='интервал обновления прайса (мин)', default=1440)
+    next_refresh = models.DateTimeField(verbose_name='следующее обновление прайса', blank=True, null=True,
+                                        db_index=True)
+    refresh_started = models.DateTimeField(verbose_name='начало текущего обновления', blank=True, null=True)
+    last_refresh = models.DateTimeField(verbose_name='последнее обновление прайса', blank=True, null=True)
+    last_refresh_duration = models.FloatField(verbose_name='длительность обновления (с)', blank=True, null=True)
+    last_refresh_lag = models.FloatField(verbose_name='задержка обновления (с)', blank=True, null=True)
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = 'Магазины'
@@ -103,6 +131,7 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='количество')
     price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='цена')
     price_rrc = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='рекомендованная цена')
+    updated_at = models.DateTimeField(verbose_name='время изменения', auto_now=True, db_index=True)
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = "Список информации о продуктах"
@@ -112,6 +141,56 @@ class ProductInfo(models.Model):
     def __str__(self):
         return f'{[self.model, self.quantity, self.price]}'
 
+class BestOffer(models.Model):
+    """
+    Лучшие предложения по продукту среди магазинов, принимающих заказы, с товаром в наличии
+    """
+    product = models.OneToOneField(Product, verbose_name='Продукт', related_name='best_offer', primary_key=True,
+                                   on_delete=models.CASCADE)
+    min_price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='минимальная цена')
+    offer_count = models.PositiveIntegerField(verbose_name='количество предложений')
+    top_offers = models.JSONField(verbose_name='лучшие предложения', default=list)
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = 'Лучшие предложения'
+    def __str__(self):
+        return f'{[self.product_id, self.min_price, self.offer_count]}'
+
+class BrinIndex(models.Index):
+    """
+    Индекс BRIN в PostgreSQL, обычный индекс в остальных базах (SQLite в тестах)
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            using = ' USING brin'
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+class PriceHistory(models.Model):
+    """
+    История изменения цен, запись добавляется только при реальном изменении цены в прайсе
+    """
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE, db_index=False)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False)
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE, db_index=False)
+    price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='цена')
+    price_rrc = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='рекомендованная цена')
+    old_price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='прежняя цена',
+                                    blank=True, null=True)
+    changed_at = models.DateTimeField(verbose_name='время изменения', auto_now_add=True)
+    class Meta:
+        verbose_name = 'Изменение цены'
+        verbose_name_plural = 'История цен'
+        indexes = [
+            # записи добавляются в порядке времени, BRIN остается крошечным на сотнях миллионов строк
+            BrinIndex(fields=['changed_at'], name='price_history_changed_brin'),
+            models.Index(fields=['shop', 'changed_at'], name='price_history_shop_changed'),
+            models.Index(fields=['category', 'changed_at'], name='price_history_cat_changed'),
+            models.Index(fields=['product', 'changed_at'], name='price_history_prod_changed'),
+        ]
+    def __str__(self):
+        return f'{[self.product_id, self.shop_id, self.old_price, self.price]}'
+
 class Parameter(models.Model):
     name = models.CharField(max_length=128, verbose_name='параметр')
     objects = models.Manager()
@@ -136,15 +215,18 @@ class ProductParameter(models.Model):
         return f'{[self.parameter, self.value]}'
 
 class OrderItem(models.Model):
-    # order = models.ForeignKey(Order, verbose_name='Заказ', on_delete=models.CASCADE, blank=True)
+    order = models.ForeignKey('Order', verbose_name='Заказ', related_name='ordered_items', on_delete=models.CASCADE,
+                              blank=True, null=True)
     product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE,blank=True)
     shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE,blank=True)
     quantity = models.PositiveIntegerField(verbose_name='количество')
+    # цена за единицу на момент оформления, у корзины не заполнена
+    price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='цена', blank=True, null=True)
     class Meta:
         verbose_name = 'Детали заказа'
         verbose_name_plural = "Детали заказов"
         constraints = [
-            models.UniqueConstraint(fields=['product'], name='unique_order_item'),]
+            models.UniqueConstraint(fields=['order', 'product', 'shop'], name='unique_order_item'),]
         # unique_together = (('product', 'quantity'),)
     def __str__(self):
         return f'{[self.product, self.shop, self.quantity]}'
@@ -170,29 +252,106 @@ class Contact(models.Model):
         return f'{self.city} {self.street} {self.house}'
 
 class Order(models.Model):
-    user = models.OneToOneField(User, verbose_name='Пользователь', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='orders', on_delete=models.CASCADE)
     dt = models.DateTimeField(verbose_name='Время создания', auto_now_add=True)
     status = models.CharField(verbose_name='Статус заказа', choices=STATE_CHOICES, max_length=15,
                             default='new')
-    orderitems = models.ManyToManyField(OrderItem, verbose_name='позиции заказа', related_name='order_item', through='Order_to_Orderitem')
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['status', 'dt'], name='order_status_dt'),
+        ]
+        constraints = [
+            # у пользователя одна корзина, оформленных заказов сколько угодно
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='basket'),
+                                    name='one_basket_per_user'),
+        ]
         # unique_together = (('id', 'orderitems'),)
     def __str__(self):
-        return f"{self.id, self.user, self.dt, self.status} ({','.join(str(orderit.product) for orderit in self.orderitems.all())})"
+        # без позиций заказа, чтобы не делать запрос на каждую строку в списках и виджетах
+        return f"{self.id, self.user_id, self.dt, self.status}"
 
 
 class Order_to_Orderitem(models.Model):
+    """
+    Прежняя связь заказов с позициями, нужна только для переноса данных командой fill_orderitem_order
+    """
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     orderitem = models.ForeignKey(OrderItem, on_delete=models.CASCADE)
 
 
+class SubOrder(models.Model):
+    """
+    Часть заказа одного магазина, рассчитывается при оформлении заказа
+    """
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='sub_orders', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='sub_orders', on_delete=models.CASCADE)
+    subtotal = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='сумма по магазину')
+    delivery_cost = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='стоимость доставки')
+
+    class Meta:
+        verbose_name = 'Подзаказ магазина'
+        verbose_name_plural = 'Подзаказы магазинов'
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'], name='unique_sub_order'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'order'], name='sub_order_shop_order'),
+        ]
+
+    def __str__(self):
+        return f'{[self.order_id, self.shop_id, self.subtotal, self.delivery_cost]}'
+
+
+class ArchivedOrder(models.Model):
+    """
+    Архив доставленных и отмененных заказов, id совпадает с id исходного заказа
+    """
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='archived_orders',
+                             on_delete=models.CASCADE)
+    dt = models.DateTimeField(verbose_name='Время создания')
+    status = models.CharField(verbose_name='Статус заказа', choices=STATE_CHOICES, max_length=15)
+    contact = models.ForeignKey(Contact, verbose_name='Контакт', blank=True, null=True,
+                                on_delete=models.SET_NULL)
+    total_sum = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='сумма заказа',
+                                    blank=True, null=True)
+    archived_at = models.DateTimeField(verbose_name='Время архивации', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архив заказов'
+        ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['user', '-dt'], name='archived_order_user_dt'),
+        ]
+
+    def __str__(self):
+        return f"{self.id, self.user_id, self.dt, self.status}"
+
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, verbose_name='Заказ', related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name='Продукт', blank=True, null=True, on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', blank=True, null=True, on_delete=models.SET_NULL)
+    quantity = models.PositiveIntegerField(verbose_name='количество')
+    price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='цена', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Позиция архивного заказа'
+        verbose_name_plural = 'Позиции архивных заказов'
+
+    def __str__(self):
+        return f'{[self.product_id, self.shop_id, self.quantity]}'
+
+
 class ConfirmEmailToken(models.Model):
     class Meta:
         verbose_name = 'Токен подтверждения Email'
@@ -230,3 +389,140 @@ class ConfirmEmailToken(models.Model):
 
     def __str__(self):
         return "Password reset token for user {user}".format(user=self.user)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Сохраненный ответ на изменяющий запрос с заголовком Idempotency-Key
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='idempotency_keys',
+                             on_delete=models.CASCADE)
+    key = models.CharField(verbose_name='Ключ', max_length=255)
+    request = models.CharField(verbose_name='Метод, путь и хеш тела запроса', max_length=255)
+    status_code = models.PositiveSmallIntegerField(verbose_name='Код ответа', blank=True, null=True)
+    content_type = models.CharField(verbose_name='Тип ответа', max_length=100, blank=True)
+    content = models.BinaryField(verbose_name='Тело ответа', blank=True, null=True)
+    created_at = models.DateTimeField(verbose_name='Время запроса', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.key}'
+
+
+class OutboxEvent(models.Model):
+    """
+    Событие для внешних обработчиков, записывается в одной транзакции с изменением данных
+    и передается в celery отдельным ретранслятором
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(verbose_name='Тип события', max_length=50)
+    payload = models.JSONField(verbose_name='Данные события', default=dict)
+    created_at = models.DateTimeField(verbose_name='Время события', auto_now_add=True)
+    processed_at = models.DateTimeField(verbose_name='Время передачи в очередь', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Событие outbox'
+        verbose_name_plural = 'События outbox'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='outbox_pending'),
+            models.Index(fields=['processed_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.topic}'
+
+
+class PriceImport(models.Model):
+    """
+    Загрузка прайса поставщика и отчет о ее результате
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='price_imports', blank=True,
+                             null=True, on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='price_imports', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка', blank=True, null=True)
+    status = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=10, default='queued')
+    report = models.JSONField(verbose_name='Отчет', blank=True, null=True)
+    created_at = models.DateTimeField(verbose_name='Время постановки', auto_now_add=True)
+    finished_at = models.DateTimeField(verbose_name='Время завершения', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайса'
+        verbose_name_plural = 'Загрузки прайсов'
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['user', 'id'], name='price_import_user'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.status}'
+
+
+class ShopSalesDaily(models.Model):
+    """
+    Продажи магазина за день: число заказов, сумма и доставка по подзаказам
+    """
+    day = models.DateField(verbose_name='День')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False)
+    orders = models.IntegerField(verbose_name='Заказов', default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Выручка', default=0)
+    delivery = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Доставка', default=0)
+
+    class Meta:
+        verbose_name = 'Продажи магазина за день'
+        verbose_name_plural = 'Продажи магазинов по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shop'], name='unique_shop_sales_daily'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'day'], name='shop_sales_shop_day'),
+        ]
+
+
+class ProductSalesDaily(models.Model):
+    """
+    Продажи продукта в магазине за день
+    """
+    day = models.DateField(verbose_name='День')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False)
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE, db_index=False)
+    quantity = models.IntegerField(verbose_name='Количество', default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Выручка', default=0)
+
+    class Meta:
+        verbose_name = 'Продажи продукта за день'
+        verbose_name_plural = 'Продажи продуктов по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shop', 'product'], name='unique_product_sales_daily'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'day'], name='product_sales_shop_day'),
+        ]
+
+
+class CategorySalesDaily(models.Model):
+    """
+    Продажи категории в магазине за день
+    """
+    day = models.DateField(verbose_name='День')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False)
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE, db_index=False)
+    quantity = models.IntegerField(verbose_name='Количество', default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Выручка', default=0)
+
+    class Meta:
+        verbose_name = 'Продажи категории за день'
+        verbose_name_plural = 'Продажи категорий по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shop', 'category'], name='unique_category_sales_daily'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'day'], name='category_sales_shop_day'),
+        ]
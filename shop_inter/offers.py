@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from shop_inter.fast_serializers import price_to_str
+from shop_inter.models import Product, ProductInfo, BestOffer
+
+
+def refresh_best_offers(product_ids):
+    """
+    Пересчет лучших предложений для указанных продуктов:
+    учитываются только магазины, принимающие заказы, и товары в наличии
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    with transaction.atomic():
+        # блокируем продукты до чтения предложений: параллельный импорт с теми же продуктами ждет
+        # конца этой транзакции, читает уже записанные цены и не вставляет те же строки BestOffer второй раз
+        list(Product.objects.select_for_update().filter(id__in=product_ids).order_by('id').values_list(
+            'id', flat=True))
+        offers = defaultdict(list)
+        for row in ProductInfo.objects.filter(
+                product_id__in=product_ids, shop__state=True, quantity__gt=0).order_by(
+                'product_id', 'price', 'id').values('id', 'product_id', 'shop_id', 'price', 'quantity'):
+            offers[row['product_id']].append(row)
+
+        best = [BestOffer(product_id=product_id,
+                          min_price=rows[0]['price'],
+                          offer_count=len(rows),
+                          top_offers=[{'id': row['id'],
+                                       'shop': row['shop_id'],
+                                       'price': price_to_str(row['price']),
+                                       'quantity': row['quantity']} for row in rows[:settings.BEST_OFFERS_TOP]])
+                for product_id, rows in offers.items()]
+        BestOffer.objects.filter(product_id__in=product_ids).delete()
+        BestOffer.objects.bulk_create(best, batch_size=1000)
+    return len(best)
+
+
+def refresh_shop_offers(shop_ids):
+    """
+    Пересчет лучших предложений по всем продуктам магазинов
+    """
+    product_ids = ProductInfo.objects.filter(shop_id__in=shop_ids).values_list('product_id', flat=True)
+    return refresh_best_offers(product_ids)
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db import transaction
+
+from shop_inter.analytics import record_sales
+from shop_inter.models import Order, STATE_TRANSITIONS
+from shop_inter.outbox import publish
+
+
+def allowed_sources(status):
+    """
+    Статусы, из которых разрешен переход в status
+    """
+    return [source for source, targets in STATE_TRANSITIONS.items() if status in targets]
+
+
+def transition_orders(order_ids, status, queryset=None):
+    """
+    Массовая смена статуса заказов: пачками по ORDER_STATUS_BATCH, один UPDATE на пачку.
+    Уведомления покупателям уходят пачками через outbox в той же транзакции.
+    queryset ограничивает, какие заказы можно менять; блокируются и обновляются сами строки заказов,
+    поэтому соединения в queryset не дают повторов.
+    Возвращает списки id обновленных и отклоненных заказов
+    """
+    order_ids = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+    queryset = Order.objects.all() if queryset is None else queryset
+    sources = allowed_sources(status)
+    updated = []
+    for start in range(0, len(order_ids), settings.ORDER_STATUS_BATCH):
+        batch = order_ids[start:start + settings.ORDER_STATUS_BATCH]
+        with transaction.atomic():
+            ids = list(Order.objects.filter(id__in=batch, status__in=sources).filter(
+                id__in=queryset.values('id')).order_by('id').select_for_update().values_list('id', flat=True))
+            if ids:
+                Order.objects.filter(id__in=ids).update(status=status)
+                if status == 'canceled':
+                    # отмененные заказы вычитаются из сводок продаж
+                    record_sales(ids, sign=-1)
+                publish('order.status_changed', order_ids=ids, status=status)
+        updated.extend(ids)
+    rejected = sorted(set(order_ids) - set(updated))
+    return updated, rejected
@@ -0,0 +1,121 @@
+import logging
+import time
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from shop_inter.models import OutboxEvent
+from shop_inter.task_metrics import metrics_client
+
+logger = logging.getLogger(__name__)
+
+# обработчики событий: тип события -> задачи celery, данные события передаются им как kwargs
+HANDLERS = {
+    'order.placed': ('shop_inter.tasks.broadcast_new_order', 'shop_inter.tasks.notify_order_placed'),
+    'order.status_changed': ('shop_inter.tasks.notify_status_changed',),
+    'price.imported': ('shop_inter.tasks.notify_price_imported',),
+    'shop.state_changed': ('shop_inter.tasks.update_shop_offers',),
+    'email': ('shop_inter.tasks.send_email',),
+}
+
+METRICS_KEY = 'outbox:metrics'
+# счетчики переданных событий по секундам для пропускной способности за окно
+RELAYED_KEY = 'outbox:relayed'
+METRICS_WINDOW = 60
+
+
+def publish(topic, **payload):
+    """
+    Запись события в outbox. Вызывается внутри транзакции, меняющей данные:
+    при откате транзакции событие пропадает вместе с изменениями
+    """
+    if topic not in HANDLERS:
+        raise ValueError(f'Неизвестный тип события {topic}')
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def relay_batch(batch_size=None):
+    """
+    Передача пачки необработанных событий в celery.
+    Отметка об обработке фиксируется только после отправки всей пачки: при ошибке брокера
+    пачка уйдет повторно (доставка at-least-once). Параллельные ретрансляторы не мешают друг другу
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH
+    with transaction.atomic():
+        events = list(OutboxEvent.objects.filter(processed_at__isnull=True).order_by('id').select_for_update(
+            skip_locked=True).values('id', 'topic', 'payload', 'created_at')[:batch_size])
+        if not events:
+            return 0
+        for event in events:
+            if event['topic'] not in HANDLERS:
+                logger.warning('Пропущено событие %s неизвестного типа %s', event['id'], event['topic'])
+                continue
+            for task in HANDLERS[event['topic']]:
+                current_app.send_task(task, kwargs=event['payload'])
+        now = timezone.now()
+        OutboxEvent.objects.filter(id__in=[event['id'] for event in events]).update(processed_at=now)
+    record_metrics(len(events), (now - events[0]['created_at']).total_seconds())
+    return len(events)
+
+
+def relay_pending(max_seconds):
+    """
+    Передача событий пачками, пока очередь не опустеет или не истечет max_seconds
+    """
+    relayed = 0
+    deadline = time.monotonic() + max_seconds
+    while time.monotonic() < deadline:
+        count = relay_batch()
+        relayed += count
+        if count < settings.OUTBOX_BATCH:
+            break
+    return relayed
+
+
+def record_metrics(count, lag):
+    """
+    Учет переданных событий в redis, общий для всех ретрансляторов: всего, по секундам за последнюю минуту
+    и задержка самого старого события пачки
+    """
+    client = metrics_client()
+    if client is None:
+        return
+    now = time.time()
+    second_key = f'{RELAYED_KEY}:{int(now)}'
+    pipe = client.pipeline(transaction=False)
+    pipe.hincrby(METRICS_KEY, 'relayed_total', count)
+    pipe.hset(METRICS_KEY, mapping={'last_run': now, 'last_lag': lag})
+    pipe.incrby(second_key, count)
+    pipe.expire(second_key, METRICS_WINDOW * 2)
+    try:
+        pipe.execute()
+    except Exception as error:
+        # метрики не должны останавливать доставку событий
+        logger.warning('Не удалось сохранить метрики outbox: %s', error)
+
+
+def stats():
+    """
+    Состояние outbox: очередь, возраст самого старого события, пропускная способность и задержка.
+    Без redis доступны только очередь и возраст
+    """
+    pending = OutboxEvent.objects.filter(processed_at__isnull=True).aggregate(oldest=Min('created_at'))
+    metrics, recent = {}, 0
+    now = time.time()
+    client = metrics_client()
+    if client is not None:
+        metrics = client.hgetall(METRICS_KEY)
+        seconds = range(int(now) - METRICS_WINDOW + 1, int(now) + 1)
+        recent = sum(int(count) for count in client.mget([f'{RELAYED_KEY}:{second}' for second in seconds])
+                     if count)
+    return {
+        'pending': OutboxEvent.objects.filter(processed_at__isnull=True).count(),
+        'oldest_pending_age': (timezone.now() - pending['oldest']).total_seconds() if pending['oldest'] else 0,
+        'relayed_total': int(metrics.get('relayed_total', 0)),
+        'throughput_per_second': recent / METRICS_WINDOW,
+        'last_lag': float(metrics['last_lag']) if 'last_lag' in metrics else None,
+        'last_run_age': now - float(metrics['last_run']) if 'last_run' in metrics else None,
+    }
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from shop_inter.routers import get_read_alias, read_from
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data):
+    """
+    Кодирует данные в JSON (bytes), через orjson если он установлен
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_NON_STR_KEYS)
+    return _encoder.encode(data).encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer, использующий orjson при его наличии
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Согласование формата text/event-stream (SSE); поток формирует само представление
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return dumps(data)
+
+
+def stream_list(serializer_class, queryset, page_size=None, descending=False):
+    """
+    Отдает список объектов как StreamingHttpResponse, сериализуя и кодируя его постранично.
+    Страницы выбираются по первичному ключу (по возрастанию, descending - по убыванию), а не по OFFSET:
+    строки, добавленные или удаленные во время выгрузки, не сдвигают страницы и не дают повторов и пропусков
+    """
+    page_size = page_size or settings.STREAM_PAGE_SIZE
+    # ответ отдается уже после выхода из представления, запоминаем базу для чтения
+    alias = get_read_alias()
+    queryset = queryset.order_by('-pk' if descending else 'pk')
+    after = 'pk__lt' if descending else 'pk__gt'
+
+    def generate():
+        yield b'['
+        with read_from(alias):
+            page = queryset
+            first = True
+            while True:
+                pks = list(page.values_list('pk', flat=True)[:page_size])
+                if not pks:
+                    break
+                items = serializer_class(queryset.filter(pk__in=pks), many=True).data
+                if items:
+                    if not first:
+                        yield b','
+                    yield dumps(items)[1:-1]
+                    first = False
+                if len(pks) < page_size:
+                    break
+                page = queryset.filter(**{after: pks[-1]})
+        yield b']'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
-from shop_inter.models import ProductInfo, Contact, Category, User, Shop, Product, OrderItem, Order, ProductParameter
+from shop_inter.cache import parameter_cache, category_cache
+from shop_inter.models import ProductInfo, Contact, Category, User, Shop, Product, OrderItem, Order, ProductParameter, \
+    ArchivedOrder, ArchivedOrderItem, PriceHistory
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -37,20 +39,26 @@ class ShopSerializer(serializers.ModelSerializer):
 
 
 class ProductSerializer(serializers.ModelSerializer):
-    category = serializers.StringRelatedField()
+    category = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = ('name', 'category',)
 
+    def get_category(self, obj):
+        return category_cache.get_name(obj.category_id)
+
 
 class ProductParameterSerializer(serializers.ModelSerializer):
-    parameter = serializers.StringRelatedField()
+    parameter = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductParameter
         fields = ('parameter', 'value',)
 
+    def get_parameter(self, obj):
+        return parameter_cache.get_name(obj.parameter_id)
+
 
 class ProductInfoSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
@@ -80,10 +88,33 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     # ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
+    orderitems = serializers.PrimaryKeyRelatedField(source='ordered_items', many=True, read_only=True)
     total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'orderitems', 'status', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
\ No newline at end of file
+        read_only_fields = ('id',)
+
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ('product', 'shop', 'quantity',)
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(read_only=True, many=True)
+    contact = ContactSerializer(read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ('id', 'items', 'status', 'dt', 'total_sum', 'contact',)
+        read_only_fields = ('id',)
+
+
+class PriceHistorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PriceHistory
+        fields = ('product', 'shop', 'category', 'old_price', 'price', 'price_rrc', 'changed_at',)
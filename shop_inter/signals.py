@@ -1,9 +1,10 @@
-from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from django_rest_passwordreset.signals import reset_password_token_created
 
-from .models import ConfirmEmailToken, User
+from .cache import parameter_cache, category_cache
+from .models import ConfirmEmailToken, User, Parameter, Category
+from .outbox import publish
 
 new_user_registered = Signal(
     providing_args=['user_id'],
@@ -30,17 +31,15 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
     """
     # send an e-mail to the user
 
-    msg = EmailMultiAlternatives(
+    publish(
+        'email',
         # title:
-        f"Password Reset Token for {reset_password_token.user}",
+        subject=f"Password Reset Token for {reset_password_token.user}",
         # message:
-        reset_password_token.key,
-        # from:
-        settings.EMAIL_HOST_USER,
+        message=reset_password_token.key,
         # to:
-        [reset_password_token.user.email]
+        recipient_list=[reset_password_token.user.email]
     )
-    msg.send()
 
 
 @receiver(new_user_registered)
@@ -51,17 +50,15 @@ def new_user_registered_signal(user_id, **kwargs):
     # send an e-mail to the user
     token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user_id)
 
-    msg = EmailMultiAlternatives(
+    publish(
+        'email',
         # title:
-        f"Password Reset Token for {token.user.email}",
+        subject=f"Password Reset Token for {token.user.email}",
         # message:
-        token.key,
-        # from:
-        settings.EMAIL_HOST_USER,
+        message=token.key,
         # to:
-        [token.user.email]
+        recipient_list=[token.user.email]
     )
-    msg.send()
 
 
 @receiver(new_order)
@@ -72,17 +69,15 @@ def new_order_signal(user_id, **kwargs):
     # send an e-mail to the user
     user = User.objects.get(id=user_id)
 
-    msg = EmailMultiAlternatives(
+    publish(
+        'email',
         # title:
-        f"Обновление статуса заказа",
+        subject=f"Обновление статуса заказа",
         # message:
-        'Заказ сформирован',
-        # from:
-        settings.EMAIL_HOST_USER,
+        message='Заказ сформирован',
         # to:
-        [user.email]
+        recipient_list=[user.email]
     )
-    msg.send()
 
 @receiver(shop_notification)
 def new_order_for_shop(user_id, id, **kwargs):
@@ -92,15 +87,26 @@ def new_order_for_shop(user_id, id, **kwargs):
     # send an e-mail to the owner shop
     user = User.objects.get(id=user_id)
 
-    msg = EmailMultiAlternatives(
+    publish(
+        'email',
         # title:
-        f"Обновление статуса заказа за номером {id}",
+        subject=f"Обновление статуса заказа за номером {id}",
         # message:
-        'в вашем магазине размещен заказ',
-        # from:
-        settings.EMAIL_HOST_USER,
+        message='в вашем магазине размещен заказ',
         # to:
-        [user.email]
+        recipient_list=[user.email]
     )
-    msg.send()
 
+
+@receiver([post_save, post_delete], sender=Parameter)
+@receiver([post_save, post_delete], sender=Category)
+def name_cache_invalidate(sender, created=False, **kwargs):
+    """
+    сбрасываем справочники параметров и категорий при изменении записей
+    """
+    if created:
+        return
+    if sender is Parameter:
+        parameter_cache.invalidate()
+    else:
+        category_cache.invalidate()
@@ -0,0 +1,150 @@
+import logging
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'celery:metrics'
+TASKS_KEY = f'{PREFIX}:tasks'
+
+# время начала задач, выполняющихся в этом процессе воркера: id задачи -> (начало, ожидание в очереди)
+_running = {}
+
+
+class TaskMetrics:
+    """
+    Счетчики и гистограммы задач celery в redis, общие для всех воркеров.
+    Для каждой задачи хранится хеш: исходы по состояниям, сумма, количество и
+    накопительные корзины гистограмм времени выполнения (runtime) и ожидания в очереди (wait)
+    """
+
+    def __init__(self):
+        self.client = None
+
+    def get_client(self):
+        if redis is None or not settings.TASK_METRICS_REDIS_URL:
+            return None
+        if self.client is None:
+            self.client = redis.Redis.from_url(settings.TASK_METRICS_REDIS_URL, decode_responses=True)
+        return self.client
+
+    def observe(self, task, state, runtime, wait):
+        client = self.get_client()
+        if client is None:
+            return
+        key = f'{PREFIX}:{task}'
+        pipe = client.pipeline(transaction=False)
+        pipe.sadd(TASKS_KEY, task)
+        pipe.hincrby(key, f'state:{state}', 1)
+        for name, value in (('runtime', runtime), ('wait', wait)):
+            if value is None:
+                continue
+            pipe.hincrbyfloat(key, f'{name}:sum', value)
+            pipe.hincrby(key, f'{name}:count', 1)
+            for bound in settings.TASK_METRICS_BUCKETS:
+                if value <= bound:
+                    pipe.hincrby(key, f'{name}:le:{bound}', 1)
+        try:
+            pipe.execute()
+        except redis.RedisError as error:
+            # метрики не должны ронять задачи
+            logger.warning('Не удалось сохранить метрики задачи %s: %s', task, error)
+
+    def tasks(self):
+        client = self.get_client()
+        if client is None:
+            return {}
+        names = sorted(client.smembers(TASKS_KEY))
+        pipe = client.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(f'{PREFIX}:{name}')
+        return dict(zip(names, pipe.execute()))
+
+    @staticmethod
+    def queues():
+        """
+        Длина очередей брокера; считается только для брокера redis
+        """
+        if redis is None or not settings.CELERY_BROKER_URL.startswith('redis'):
+            return {}
+        names = {route['queue'] for route in settings.CELERY_TASK_ROUTES.values()} | {'celery'}
+        client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+        pipe = client.pipeline(transaction=False)
+        for name in sorted(names):
+            pipe.llen(name)
+        return dict(zip(sorted(names), pipe.execute()))
+
+
+task_metrics = TaskMetrics()
+
+
+def metrics_client():
+    """
+    Клиент redis для метрик, общих для всех процессов (outbox, очистка); None, если redis не настроен
+    """
+    return task_metrics.get_client()
+
+
+def mark_published(headers):
+    headers['enqueued_at'] = time.time()
+
+
+def queue_wait(request, now):
+    """
+    Сколько задача ждала в очереди; для отложенных задач - с момента, когда ее можно было начать
+    """
+    enqueued_at = getattr(request, 'enqueued_at', None) or (getattr(request, 'headers', None) or {}).get(
+        'enqueued_at')
+    if not enqueued_at:
+        return None
+    eta = getattr(request, 'eta', None)
+    if eta:
+        try:
+            enqueued_at = max(enqueued_at, datetime.fromisoformat(eta).timestamp())
+        except (TypeError, ValueError):
+            pass
+    return max(now - enqueued_at, 0.0)
+
+
+def task_started(task_id, request):
+    _running[task_id] = (time.monotonic(), queue_wait(request, time.time()))
+
+
+def task_finished(task_id, task_name, state):
+    started, wait = _running.pop(task_id, (None, None))
+    runtime = time.monotonic() - started if started is not None else None
+    task_metrics.observe(task_name, state or 'UNKNOWN', runtime, wait)
+
+
+def render_prometheus():
+    """
+    Метрики задач и очередей в текстовом формате Prometheus
+    """
+    lines = []
+    tasks = task_metrics.tasks()
+    lines.append('# TYPE celery_task_total counter')
+    for task, fields in tasks.items():
+        for field, value in sorted(fields.items()):
+            if field.startswith('state:'):
+                lines.append(f'celery_task_total{{task="{task}",state="{field[6:]}"}} {value}')
+    for name, title in (('runtime', 'celery_task_runtime_seconds'), ('wait', 'celery_task_queue_wait_seconds')):
+        lines.append(f'# TYPE {title} histogram')
+        for task, fields in tasks.items():
+            if f'{name}:count' not in fields:
+                continue
+            for bound in settings.TASK_METRICS_BUCKETS:
+                lines.append(f'{title}_bucket{{task="{task}",le="{bound}"}} {fields.get(f"{name}:le:{bound}", 0)}')
+            lines.append(f'{title}_bucket{{task="{task}",le="+Inf"}} {fields[f"{name}:count"]}')
+            lines.append(f'{title}_sum{{task="{task}"}} {fields[f"{name}:sum"]}')
+            lines.append(f'{title}_count{{task="{task}"}} {fields[f"{name}:count"]}')
+    lines.append('# TYPE celery_queue_length gauge')
+    for queue, length in task_metrics.queues().items():
+        lines.append(f'celery_queue_length{{queue="{queue}"}} {length}')
+    return '\n'.join(lines) + '\n'
@@ -1,9 +1,36 @@
+import logging
+import random
+import time
+from smtplib import SMTPException
+from datetime import timedelta
+from urllib.parse import urlparse
+
 from django.contrib.auth import get_user_model
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import send_mail, EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from shop_app import settings
-from .models import User
-@shared_task(bind=True)
+from .cleanup import run_cleanup
+from .etags import catalog_version
+from .export import available_formats, build_snapshot
+from .feed import order_feed
+from .offers import refresh_shop_offers
+from .outbox import relay_pending
+from .importer import fetch_price, fetch_prices, import_price, parse_price
+from .validation import FeedValidationError
+from .models import STATE_CHOICES, User, Shop, Order, OrderItem, SubOrder, ArchivedOrder, ArchivedOrderItem, \
+    IdempotencyKey, OutboxEvent, PriceImport
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_STATUSES = ('delivered', 'canceled')
+
+# ошибки почты не скрываются: задача повторяется, а неудачи видны в метриках задач
+MAIL_RETRY = {'autoretry_for': (SMTPException, OSError), 'retry_backoff': True, 'max_retries': 5}
+
+@shared_task(bind=True, **MAIL_RETRY)
 def new_order_func(self,user_id):
     user = User.objects.get(id=user_id)
     mail_subject=f"Обновление статуса заказа"
@@ -14,11 +41,11 @@ def new_order_func(self,user_id):
         message=message,
         from_email=settings.EMAIL_HOST_USER,
         recipient_list=[to_email],
-        fail_silently=True,
+        fail_silently=False,
     )
     return "Done"
 
-@shared_task(bind=True)
+@shared_task(bind=True, **MAIL_RETRY)
 def new_order_shop(self, user_id, id):
     user = User.objects.get(id=user_id)
     mail_subject=f"Обновление статуса заказа за номером {id}"
@@ -29,6 +56,304 @@ def new_order_shop(self, user_id, id):
         message=message,
         from_email=settings.EMAIL_HOST_USER,
         recipient_list=[to_email],
-        fail_silently=True,
+        fail_silently=False,
+    )
+    return "Done"
+
+@shared_task(bind=True)
+def broadcast_new_order(self, order_id, user_id=None):
+    """
+    Публикация нового заказа в ленту поставщиков
+    """
+    events = [list(row) for row in SubOrder.objects.filter(order_id=order_id).values_list('id', 'shop_id', 'order_id')]
+    order_feed.publish(events)
+    return len(events)
+
+
+@shared_task(bind=True)
+def notify_order_placed(self, order_id, user_id):
+    """
+    Уведомление покупателя и владельцев магазинов о размещенном заказе.
+    Каждое письмо - отдельная задача: повтор после ошибки SMTP не отправляет письмо тем, кто его уже получил
+    """
+    new_order_func.delay(user_id)
+    for shop_user_id in Shop.objects.filter(sub_orders__order_id=order_id).values_list(
+            'user_id', flat=True).distinct():
+        new_order_shop.delay(shop_user_id, order_id)
+    return "Done"
+
+
+@shared_task(bind=True)
+def notify_status_changed(self, order_ids, status):
+    """
+    Уведомление покупателей о смене статуса пачки заказов, по задаче send_email на заказ
+    """
+    status_name = dict(STATE_CHOICES)[status]
+    sent = 0
+    for order_id, email in Order.objects.filter(id__in=order_ids).values_list('id', 'user__email'):
+        send_email.delay(f"Обновление статуса заказа за номером {order_id}",
+                         f"Статус заказа: {status_name}",
+                         [email])
+        sent += 1
+    return sent
+
+
+@shared_task(bind=True, **MAIL_RETRY)
+def send_email(self, subject, message, recipient_list):
+    """
+    Отправка письма вне обработчика запроса
+    """
+    msg = EmailMultiAlternatives(subject, message, settings.EMAIL_HOST_USER, recipient_list)
+    msg.send()
+    return "Done"
+
+
+def run_import(record, data, notify=False):
+    """
+    Импорт прайса с записью результата в PriceImport
+    """
+    try:
+        shop = import_price(data, record.user_id, record.url, notify)
+    except FeedValidationError as error:
+        record.status, record.report = 'invalid', error.report
+        raise
+    except Exception as error:
+        record.status, record.report = 'failed', {'error': str(error)}
+        raise
+    else:
+        record.status, record.shop = 'done', shop
+        record.report = {'valid': True, 'rows': len(data['goods']), 'error_count': 0, 'errors': []}
+    finally:
+        record.finished_at = timezone.now()
+        record.save()
+    return shop
+
+
+@shared_task(bind=True)
+def import_shop_price(self, url, user_id, import_id=None):
+    """
+    Загрузка и импорт прайса по запросу поставщика
+    """
+    if import_id:
+        record = PriceImport.objects.get(id=import_id)
+    else:
+        record = PriceImport.objects.create(user_id=user_id, url=url)
+    try:
+        data = fetch_price(url)
+    except Exception as error:
+        record.status, record.report, record.finished_at = 'failed', {'error': str(error)}, timezone.now()
+        record.save()
+        raise
+    try:
+        run_import(record, data, notify=True)
+    except FeedValidationError:
+        return "Invalid"
+    return "Done"
+
+
+@shared_task(bind=True, **MAIL_RETRY)
+def notify_price_imported(self, shop_id, products):
+    """
+    Уведомление поставщика о загруженном прайсе
+    """
+    shop = Shop.objects.select_related('user').get(id=shop_id)
+    if shop.user is None:
+        return "Skipped"
+    send_mail(
+        subject=f"Прайс магазина {shop.name} загружен",
+        message=f"Загружено товаров: {products}",
+        from_email=settings.EMAIL_HOST_USER,
+        recipient_list=[shop.user.email],
+        fail_silently=False,
     )
-    return "Done"
\ No newline at end of file
+    return "Done"
+
+
+@shared_task(bind=True)
+def update_shop_offers(self, shop_ids):
+    """
+    Пересчет лучших предложений после изменения статуса магазинов
+    """
+    return refresh_shop_offers(shop_ids)
+
+
+@shared_task(bind=True)
+def build_catalog_snapshots(self, export_formats=None):
+    """
+    Построение снимков каталога текущей версии для выгрузки
+    """
+    version = catalog_version()
+    for export_format in export_formats or available_formats():
+        build_snapshot(export_format, version)
+    return version
+
+
+def refresh_stale_after():
+    """
+    Через сколько секунд без новой отметки обновление считается зависшим. Покрывает загрузку всей пачки,
+    даже если все ее магазины на одном сервере и загружаются по очереди с паузой SHOP_REFRESH_HOST_DELAY,
+    и ожидание запуска до SHOP_REFRESH_JITTER; импорт каждого магазина начинается с новой отметки
+    """
+    return (settings.SHOP_REFRESH_BATCH * (settings.SHOP_REFRESH_TIMEOUT + settings.SHOP_REFRESH_HOST_DELAY) +
+            settings.SHOP_REFRESH_JITTER)
+
+
+@shared_task(bind=True)
+def refresh_shop_prices(self, shop_ids):
+    """
+    Обновление прайсов магазинов по их ссылкам: загрузка параллельно, импорт по очереди
+    """
+    shops = list(Shop.objects.filter(id__in=shop_ids, url__isnull=False).only(
+        'id', 'url', 'user_id', 'refresh_started'))
+    started = timezone.now()
+    # refresh_started - отметка хода обновления: пока она моложе refresh_stale_after(), планировщик
+    # считает магазины занятыми. Отметка ставится перед загрузкой и перед импортом каждого магазина
+    # для всех еще не обработанных магазинов пачки
+    Shop.objects.filter(id__in=[shop.id for shop in shops]).update(refresh_started=started)
+    results = fetch_prices([shop.url for shop in shops])
+    refreshed = 0
+    for number, (shop, (stream, error, fetch_time)) in enumerate(zip(shops, results)):
+        Shop.objects.filter(id__in=[shop.id for shop in shops[number:]]).update(refresh_started=timezone.now())
+        import_started = time.monotonic()
+        try:
+            if error is not None:
+                raise error
+            run_import(PriceImport(user_id=shop.user_id, shop=shop, url=shop.url), parse_price(stream))
+        except Exception as error:
+            Shop.objects.filter(id=shop.id).update(refresh_started=None)
+            logger.warning('Не удалось обновить прайс магазина %s: %s', shop.id, error)
+            continue
+        # задержка - сколько задача ждала в очереди после постановки планировщиком
+        lag = (started - shop.refresh_started).total_seconds() if shop.refresh_started else None
+        Shop.objects.filter(id=shop.id).update(refresh_started=None,
+                                               last_refresh=timezone.now(),
+                                               last_refresh_duration=fetch_time + time.monotonic() - import_started,
+                                               last_refresh_lag=lag)
+        refreshed += 1
+    return refreshed
+
+
+@shared_task(bind=True)
+def refresh_shop_price(self, shop_id):
+    """
+    Обновление прайса одного магазина, для задач, поставленных до пакетного обновления
+    """
+    return refresh_shop_prices(shop_ids=[shop_id])
+
+
+@shared_task(bind=True)
+def schedule_price_refresh(self):
+    """
+    Планировщик обновления прайсов, запускается celery beat.
+    Одновременно обновляется не больше SHOP_REFRESH_BATCH магазинов, считая поставленные в очередь,
+    а к серверу поставщика, прайс с которого еще загружается, новые запросы не ставятся
+    """
+    now = timezone.now()
+    # зависшие обновления не занимают слоты бесконечно
+    stale = now - timedelta(seconds=refresh_stale_after())
+    running = list(Shop.objects.filter(refresh_started__gt=stale).values_list('url', flat=True))
+    slots = settings.SHOP_REFRESH_BATCH - len(running)
+    if slots <= 0:
+        return 0
+
+    busy_hosts = {urlparse(url).hostname for url in running if url}
+    candidates = Shop.objects.filter(
+        Q(next_refresh__isnull=True) | Q(next_refresh__lte=now),
+        Q(refresh_started__isnull=True) | Q(refresh_started__lte=stale),
+        state=True, url__isnull=False).exclude(url='').order_by('next_refresh').only(
+        'id', 'url', 'refresh_interval')[:settings.SHOP_REFRESH_BATCH]
+    shops = [shop for shop in candidates if urlparse(shop.url).hostname not in busy_hosts][:slots]
+    if not shops:
+        return 0
+
+    countdown = random.uniform(0, settings.SHOP_REFRESH_JITTER)
+    for shop in shops:
+        next_refresh = now + timedelta(minutes=shop.refresh_interval,
+                                       seconds=random.uniform(0, settings.SHOP_REFRESH_JITTER))
+        Shop.objects.filter(id=shop.id).update(refresh_started=now + timedelta(seconds=countdown),
+                                               next_refresh=next_refresh)
+    refresh_shop_prices.apply_async(([shop.id for shop in shops],), countdown=countdown)
+    return len(shops)
+
+
+@shared_task(bind=True)
+def archive_orders(self):
+    """
+    Перенос старых доставленных и отмененных заказов в архив пачками
+    """
+    border = timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AGE)
+    archived = 0
+    while True:
+        with transaction.atomic():
+            orders = list(Order.objects.filter(
+                status__in=ARCHIVE_STATUSES, dt__lt=border).order_by('dt').select_for_update(
+                skip_locked=True).values('id', 'user_id', 'dt', 'status', 'contact_id')[:settings.ORDER_ARCHIVE_BATCH])
+            if not orders:
+                break
+            order_ids = [order['id'] for order in orders]
+            items = list(OrderItem.objects.filter(order_id__in=order_ids).values(
+                'order_id', 'product_id', 'shop_id', 'quantity', 'price'))
+            # сумма по ценам, зафиксированным при оформлении, плюс доставка; текущий прайс магазина
+            # к архиву отношения не имеет. Без цен в позициях (заказы до их появления) сумма неизвестна
+            totals = {}
+            for item in items:
+                if item['price'] is not None:
+                    totals[item['order_id']] = totals.get(item['order_id'], 0) + item['quantity'] * item['price']
+            for sub_order in SubOrder.objects.filter(order_id__in=list(totals)).values('order_id', 'delivery_cost'):
+                totals[sub_order['order_id']] += sub_order['delivery_cost']
+
+            ArchivedOrder.objects.bulk_create(
+                [ArchivedOrder(total_sum=totals.get(order['id']), **order) for order in orders])
+            ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(**item) for item in items])
+            # позиции удаляются каскадно вместе с заказами
+            Order.objects.filter(id__in=order_ids).delete()
+        archived += len(orders)
+    return archived
+
+
+@shared_task(bind=True)
+def sweep_idempotency_keys(self):
+    """
+    Удаление просроченных ключей идемпотентности пачками
+    """
+    border = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=border).values_list(
+            'id', flat=True)[:settings.IDEMPOTENCY_SWEEP_BATCH])
+        if not ids:
+            break
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+    return deleted
+
+
+@shared_task(bind=True)
+def relay_outbox(self):
+    """
+    Передача накопленных событий outbox в очередь, запускается celery beat
+    """
+    return relay_pending(settings.CELERY_BEAT_SCHEDULE['relay-outbox']['schedule'])
+
+
+@shared_task(bind=True)
+def sweep_outbox(self):
+    """
+    Удаление давно переданных событий outbox пачками
+    """
+    border = timezone.now() - timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = list(OutboxEvent.objects.filter(processed_at__lt=border).values_list(
+            'id', flat=True)[:settings.OUTBOX_BATCH])
+        if not ids:
+            break
+        deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+    return deleted
+
+
+@shared_task(bind=True)
+def cleanup_expired(self):
+    """
+    Удаление просроченных токенов и брошенных корзин пачками, запускается celery beat
+    """
+    return run_cleanup()
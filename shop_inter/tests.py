@@ -1,3 +1,982 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import skipUnless, mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+import redis
+
+from shop_app.celery import app as celery_app
+from shop_inter import export, validation
+from shop_inter.cache import category_cache, parameter_cache
+from shop_inter.analytics import record_sales
+from shop_inter.checkout import price_order
+from shop_inter.cleanup import run_cleanup, delete_in_batches
+from shop_inter.fast_serializers import FastProductInfoSerializer, FastOrderItemSerializer, FastOrderSerializer
+from shop_inter.etags import catalog_version
+from shop_inter.feed import stream_slots
+from shop_inter.importer import parse_delta, apply_deltas, collect_deltas, ambiguous_external_ids, finish_results
+from shop_inter.models import User, Shop, Category, Product, ProductInfo, PriceHistory, Order, OrderItem, SubOrder, \
+    ShopSalesDaily, ProductSalesDaily, CategorySalesDaily, BestOffer, ArchivedOrder, ArchivedOrderItem, \
+    ConfirmEmailToken, Contact, ProductParameter, IdempotencyKey, OutboxEvent
+from shop_inter.offers import refresh_best_offers
+from shop_inter.order_status import transition_orders
+from shop_inter.outbox import publish, relay_pending, stats as outbox_stats
+from shop_inter.renderers import FastJSONRenderer
+from shop_inter.serializers import ProductInfoSerializer, OrderItemSerializer, OrderSerializer
+from shop_inter.task_metrics import task_metrics, queue_wait, mark_published, render_prometheus
+from shop_inter.tasks import archive_orders, refresh_shop_prices, schedule_price_refresh, refresh_stale_after
+from shop_inter.throttling import TokenBucketThrottle, LoadSheddingThrottle, Overloaded, db_latency, local_buckets
+
+# запросы с INSERT ... ON CONFLICT и UPDATE ... FROM (VALUES ...) есть только в PostgreSQL
+postgres_only = skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL')
+
+
+def create_shop(name):
+    user = User.objects.create_user(email=f'{name}@example.com', password='secret', type='shop', is_active=True)
+    return Shop.objects.create(name=name, user=user)
+
+
+def create_offer(shop, product, external_id, price='100.00'):
+    return ProductInfo.objects.create(product=product, shop=shop, external_id=external_id, model='m',
+                                      quantity=10, price=Decimal(price), price_rrc=Decimal(price))
+
+
+def create_order(buyer, shops, status='new'):
+    order = Order.objects.create(user=buyer, status=status)
+    for shop in shops:
+        SubOrder.objects.create(order=order, shop=shop, subtotal=0, delivery_cost=0)
+    return order
+
+
+@skipUnless('replica1' in settings.DATABASES, 'нужна реплика replica1, см. shop_app/settings_test.py')
+class ReplicaRoutingTests(TestCase):
+    """
+    Маршрутизация чтения между основной базой и репликой. В тестах реплика зеркалит основную базу,
+    поэтому данные пишутся только в нее, а проверяется соединение, через которое прошли запросы
+    """
+    databases = {'default', 'replica1'}
+
+    def get_categories(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.client.get(reverse('categories'))
+        self.assertEqual(response.status_code, 200)
+        return primary, replica
+
+    def test_safe_request_reads_from_replica(self):
+        primary, replica = self.get_categories()
+        self.assertTrue(replica.captured_queries)
+        self.assertFalse(primary.captured_queries)
+
+    def test_write_pins_client_to_primary(self):
+        response = self.client.post(reverse('user-login'), {})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('replica_pin', response.cookies)
+
+        primary, replica = self.get_categories()
+        self.assertTrue(primary.captured_queries)
+        self.assertFalse(replica.captured_queries)
+
+
+
+GOODS = [
+    {'id': 1, 'category': 1, 'model': 'a', 'name': 'Телефон', 'price': 100, 'price_rrc': 120, 'quantity': 5,
+     'parameters': {'Цвет': 'черный'}},
+    {'id': 2, 'category': 1, 'model': 'b', 'name': 'Планшет', 'price': 'дорого', 'price_rrc': -1, 'quantity': 1.5,
+     'parameters': []},
+    {'id': 'x', 'category': 99, 'model': 'c', 'name': 'Часы', 'price': 10, 'price_rrc': 10, 'quantity': 1,
+     'parameters': {}},
+    {'id': 2, 'category': 2, 'model': 'd', 'name': 'Наушники', 'price': 1, 'price_rrc': 1, 'quantity': 0,
+     'parameters': {}},
+    {'id': 5, 'category': 1, 'model': 'a', 'name': 'Телефон', 'price': 90, 'price_rrc': 120, 'quantity': 1,
+     'parameters': {}},
+    {'id': 6, 'category': 2, 'model': 'e', 'name': 'Кабель', 'price': None, 'price_rrc': 5, 'quantity': 3},
+]
+
+EXPECTED = [
+    (0, 'duplicate_product', 'name'),
+    (1, 'price', 'price'),
+    (1, 'price_rrc', 'price_rrc'),
+    (1, 'quantity', 'quantity'),
+    (1, 'parameters', 'parameters'),
+    (1, 'duplicate_id', 'id'),
+    (2, 'id', 'id'),
+    (2, 'category', 'category'),
+    (3, 'duplicate_id', 'id'),
+    (4, 'duplicate_product', 'name'),
+    (5, 'missing', 'price'),
+    (5, 'missing', 'parameters'),
+]
+
+
+def sorted_found(found):
+    return sorted(((int(row), check, field) for row, check, field in found),
+                  key=lambda error: (error[0], validation.CHECK_ORDER[error[1]],
+                                     validation.REQUIRED_GOODS_KEYS.index(error[2])))
+
+
+class CheckersTests(SimpleTestCase):
+    """
+    Построчная проверка прайса и проверка столбцами pandas должны находить одни и те же ошибки
+    """
+    rows = list(enumerate(GOODS))
+    known_categories = {1, 2}
+
+    def test_check_rows(self):
+        self.assertEqual(sorted_found(validation.check_rows(self.rows, self.known_categories)), EXPECTED)
+
+    @skipUnless(validation.pandas is not None, 'pandas не установлен')
+    def test_check_columns_matches_check_rows(self):
+        self.assertEqual(sorted_found(validation.check_columns(self.rows, self.known_categories)),
+                         sorted_found(validation.check_rows(self.rows, self.known_categories)))
+
+    @skipUnless(validation.pandas is not None, 'pandas не установлен')
+    def test_checkers_agree_on_valid_feed(self):
+        rows = [(0, GOODS[0]), (1, dict(GOODS[3], id=3))]
+        self.assertEqual(validation.check_columns(rows, self.known_categories), [])
+        self.assertEqual(validation.check_rows(rows, self.known_categories), [])
+
+
+class ValidatePriceTests(TestCase):
+    def test_report(self):
+        report = validation.validate_price({
+            'shop': 'Связной',
+            'categories': [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Аксессуары'}],
+            'goods': GOODS,
+        })
+        self.assertFalse(report['valid'])
+        self.assertEqual(report['rows'], len(GOODS))
+        self.assertEqual(report['error_count'], len(EXPECTED))
+        self.assertEqual([(error['row'], error['field']) for error in report['errors']],
+                         [(row, field) for row, _, field in EXPECTED])
+        self.assertEqual(report['errors'][6]['external_id'], 'x')
+
+    def test_missing_sections(self):
+        report = validation.validate_price({'goods': []})
+        self.assertEqual([error['field'] for error in report['errors']], ['shop', 'categories', 'goods'])
+
+
+class ParseDeltaTests(SimpleTestCase):
+    def test_valid(self):
+        self.assertEqual(parse_delta({'external_id': 7, 'price': '10.5', 'quantity': 0}),
+                         (7, Decimal('10.5'), None, 0))
+
+    def test_invalid(self):
+        for item in ({'external_id': 7},
+                     {'external_id': True, 'price': 1},
+                     {'external_id': -1, 'price': 1},
+                     {'external_id': 2 ** 31, 'price': 1},
+                     {'external_id': 7, 'price': -1},
+                     {'external_id': 7, 'price': '1.001'},
+                     {'external_id': 7, 'price': 'NaN'},
+                     {'external_id': 7, 'quantity': 1.5},
+                     {'external_id': 7, 'quantity': True},
+                     [7, 1]):
+            with self.subTest(item=item), self.assertRaises(ValueError):
+                parse_delta(item)
+
+
+
+class DeltaResultsTests(SimpleTestCase):
+    def test_collect_deltas(self):
+        results, deltas = collect_deltas([{'external_id': 1, 'price': 10}, {'external_id': 2 ** 31, 'price': 1},
+                                          {'external_id': 1, 'price': 20}, 'x'])
+        self.assertEqual(deltas, {1: (1, Decimal('20'), None, None)})
+        self.assertEqual([result.get('Status') for result in results], [None, False, None, False])
+        self.assertEqual(results[1]['external_id'], 2 ** 31)
+
+    def test_finish_results(self):
+        results = finish_results([{'external_id': 1}, {'external_id': 2}, {'external_id': 3},
+                                  {'external_id': None, 'Status': False, 'Error': 'Ожидается объект'}],
+                                 updated={1}, ambiguous={2})
+        self.assertEqual([result['Status'] for result in results], [True, False, False, False])
+        self.assertNotIn('Error', results[0])
+        self.assertIn('несколько', results[1]['Error'])
+        self.assertEqual(results[2]['Error'], 'Предложение не найдено')
+        self.assertEqual(results[3]['Error'], 'Ожидается объект')
+
+
+class AmbiguousExternalIdsTests(TestCase):
+    def test_ambiguous(self):
+        shop, other_shop = create_shop('shop'), create_shop('other')
+        category = Category.objects.create(name='Смартфоны')
+        products = [Product.objects.create(name=f'Телефон {number}', category=category) for number in range(3)]
+        create_offer(shop, products[0], external_id=1)
+        create_offer(shop, products[1], external_id=2)
+        create_offer(shop, products[2], external_id=2)
+        create_offer(other_shop, products[0], external_id=1)
+        self.assertEqual(ambiguous_external_ids(shop.id, [1, 2, 3]), {2})
+        self.assertEqual(ambiguous_external_ids(other_shop.id, [1, 2]), set())
+
+@postgres_only
+class ApplyDeltasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = create_shop('shop')
+        category = Category.objects.create(name='Смартфоны')
+        products = [Product.objects.create(name=f'Телефон {number}', category=category) for number in range(3)]
+        cls.offer = create_offer(cls.shop, products[0], external_id=1)
+        # два предложения с одним external_id
+        create_offer(cls.shop, products[1], external_id=2)
+        create_offer(cls.shop, products[2], external_id=2)
+
+    def test_results(self):
+        results = apply_deltas(self.shop.id, [
+            {'external_id': 1, 'price': '90.00', 'quantity': 3},
+            {'external_id': 2, 'price': '50.00'},
+            {'external_id': 3, 'quantity': 1},
+            {'external_id': 1},
+            {'external_id': 2 ** 31, 'price': '1.00'},
+        ])
+        self.assertEqual([result['Status'] for result in results], [True, False, False, False, False])
+        self.assertIn('несколько', results[1]['Error'])
+        self.assertEqual(results[2]['Error'], 'Предложение не найдено')
+
+        self.offer.refresh_from_db()
+        self.assertEqual((self.offer.price, self.offer.quantity), (Decimal('90.00'), 3))
+        self.assertEqual(set(ProductInfo.objects.filter(external_id=2).values_list('price', flat=True)),
+                         {Decimal('100.00')})
+        history = PriceHistory.objects.get()
+        self.assertEqual((history.old_price, history.price), (Decimal('100.00'), Decimal('90.00')))
+
+    def test_quantity_only_keeps_history(self):
+        apply_deltas(self.shop.id, [{'external_id': 1, 'quantity': 0}])
+        self.assertFalse(PriceHistory.objects.exists())
+
+
+class TransitionOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        cls.shop = create_shop('shop')
+        cls.other_shop = create_shop('other')
+
+    def test_allowed_transitions(self):
+        new = create_order(self.buyer, [self.shop])
+        delivered = create_order(self.buyer, [self.shop], status='delivered')
+        updated, rejected = transition_orders([new.id, delivered.id, new.id], 'confirmed')
+        self.assertEqual(updated, [new.id])
+        self.assertEqual(rejected, [delivered.id])
+        self.assertEqual(Order.objects.get(id=new.id).status, 'confirmed')
+
+    def test_supplier_changes_only_own_orders(self):
+        token = Token.objects.create(user=self.shop.user)
+        # заказ из двух магазинов одного поставщика обновляется один раз
+        second_shop = Shop.objects.create(name='shop2', user=self.shop.user)
+        own = create_order(self.buyer, [self.shop, second_shop])
+        # заказ с позициями другого поставщика меняет только администратор
+        shared = create_order(self.buyer, [self.shop, self.other_shop])
+        foreign = create_order(self.buyer, [self.other_shop])
+        response = self.client.post(reverse('partner-orders-status'),
+                                    {'items': f'{own.id},{shared.id},{foreign.id}', 'status': 'confirmed'},
+                                    HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.json()['Обновлено'], [own.id])
+        self.assertEqual(response.json()['Отклонено'], sorted([shared.id, foreign.id]))
+        self.assertEqual(Order.objects.get(id=shared.id).status, 'new')
+
+    def test_admin_status_is_read_only(self):
+        admin_user = User.objects.create_superuser(email='admin@example.com', password='secret')
+        self.client.force_login(admin_user)
+        order = create_order(self.buyer, [self.shop])
+        response = self.client.get(reverse('admin:shop_inter_order_change', args=[order.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="status"')
+
+
+
+class ThrottledView:
+    def __init__(self, scope=None, cost=1):
+        self.throttle_scope = scope
+        self.throttle_cost = cost
+
+
+@override_settings(RATE_LIMIT_BUCKETS={'default': {'capacity': 3, 'rate': 1}, 'orders': {'capacity': 10, 'rate': 2}})
+class TokenBucketThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        local_buckets.data.clear()
+        self.now = 1000.0
+        patcher = mock.patch('shop_inter.throttling.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def allow(self, view, ip='10.0.0.1'):
+        throttle = TokenBucketThrottle()
+        request = APIRequestFactory().get('/', REMOTE_ADDR=ip)
+        request.user = None
+        return throttle.allow_request(request, view), throttle.wait()
+
+    def test_capacity_and_refill(self):
+        view = ThrottledView()
+        self.assertEqual([self.allow(view)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(self.allow(view), (False, 1.0))
+        self.now += 0.5
+        self.assertEqual(self.allow(view), (False, 0.5))
+        self.now += 0.5
+        self.assertEqual(self.allow(view), (True, None))
+        # за простой корзина наполняется не больше capacity
+        self.now += 100
+        self.assertEqual([self.allow(view)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_cost_and_separate_buckets(self):
+        expensive = ThrottledView('orders', cost=4)
+        self.assertEqual([self.allow(expensive)[0] for _ in range(3)], [True, True, False])
+        self.assertEqual(self.allow(expensive)[1], 1.0)
+        # другой класс эндпоинтов и другой клиент - свои корзины
+        self.assertTrue(self.allow(ThrottledView())[0])
+        self.assertTrue(self.allow(expensive, ip='10.0.0.2')[0])
+        # неизвестный класс эндпоинтов использует корзину default
+        self.assertEqual([self.allow(ThrottledView('unknown'))[0] for _ in range(4)], [True, True, True, False])
+
+    def test_local_fallback_when_cache_fails(self):
+        view = ThrottledView()
+        with mock.patch('shop_inter.throttling.cache.get', side_effect=ConnectionError), \
+                mock.patch('shop_inter.throttling.cache.set', side_effect=ConnectionError):
+            self.assertEqual([self.allow(view)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(len(local_buckets.data), 1)
+
+    def test_api_returns_429(self):
+        for _ in range(3):
+            self.assertNotEqual(self.client.get(reverse('basket')).status_code, 429)
+        response = self.client.get(reverse('basket'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class LoadSheddingThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(setattr, db_latency, 'value', db_latency.value)
+        self.addCleanup(setattr, db_latency, 'checked', db_latency.checked)
+        # задержка уже измерена, повторный замер через LOAD_SHED_CHECK_INTERVAL
+        db_latency.checked = time.monotonic()
+
+    def test_sheds_only_expensive_requests(self):
+        throttle, request = LoadSheddingThrottle(), APIRequestFactory().get('/')
+        db_latency.value = settings.LOAD_SHED_DB_LATENCY * 2
+        self.assertTrue(throttle.allow_request(request, ThrottledView(cost=settings.LOAD_SHED_MIN_COST - 1)))
+        with self.assertRaises(Overloaded) as raised:
+            throttle.allow_request(request, ThrottledView(cost=settings.LOAD_SHED_MIN_COST))
+        self.assertEqual(raised.exception.wait, settings.LOAD_SHED_RETRY_AFTER)
+        db_latency.value = 0
+        self.assertTrue(throttle.allow_request(request, ThrottledView(cost=settings.LOAD_SHED_MIN_COST)))
+
+@postgres_only
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        cls.shop = create_shop('shop')
+        category = Category.objects.create(name='Смартфоны')
+        cls.product = Product.objects.create(name='Телефон', category=category)
+        cls.offer = create_offer(cls.shop, cls.product, external_id=1, price='100.00')
+
+    def place_order(self):
+        order = Order.objects.create(user=self.buyer, status='new')
+        OrderItem.objects.create(order=order, product=self.product, shop=self.shop, quantity=2)
+        price_order(order.id)
+        record_sales([order.id])
+        return order
+
+    def test_cancel_reverts_rollups(self):
+        order = self.place_order()
+        self.assertEqual(ProductSalesDaily.objects.get().revenue, Decimal('200.00'))
+
+        # отмена вычитает сумму по цене оформления, а не по текущему прайсу
+        ProductInfo.objects.filter(id=self.offer.id).update(price=Decimal('150.00'))
+        transition_orders([order.id], 'canceled')
+
+        shop_row = ShopSalesDaily.objects.get()
+        self.assertEqual((shop_row.orders, shop_row.revenue, shop_row.delivery), (0, 0, 0))
+        for model in (ProductSalesDaily, CategorySalesDaily):
+            row = model.objects.get()
+            self.assertEqual((row.quantity, row.revenue), (0, 0))
+
+
+class BasketTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+
+    def test_one_basket_per_user(self):
+        basket = Order.objects.basket(self.buyer.id)
+        self.assertEqual(Order.objects.basket(self.buyer.id).id, basket.id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.buyer, status='basket')
+        # оформленных заказов может быть сколько угодно
+        Order.objects.create(user=self.buyer, status='new')
+        Order.objects.create(user=self.buyer, status='new')
+        self.assertEqual(Order.objects.filter(user=self.buyer, status='basket').count(), 1)
+
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop('shop')
+        category = Category.objects.create(name='Смартфоны')
+        self.product = Product.objects.create(name='Телефон', category=category)
+        self.case = Product.objects.create(name='Чехол', category=category)
+        create_offer(self.shop, self.product, external_id=1)
+        create_offer(self.shop, self.case, external_id=2)
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        self.token = Token.objects.create(user=self.buyer)
+
+    def add_to_basket(self, key, quantity=1, token=None, product=None):
+        item = {'product': (product or self.product).id, 'shop': self.shop.id, 'quantity': quantity}
+        return self.client.post(reverse('basket'), json.dumps({'items': [item]}), content_type='application/json',
+                                HTTP_IDEMPOTENCY_KEY=key, HTTP_AUTHORIZATION=f'Token {(token or self.token).key}')
+
+    def test_replay_returns_saved_response(self):
+        first = self.add_to_basket('key-1')
+        self.assertEqual(first.json()['Status'], True)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        replay = self.add_to_basket('key-1')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual((replay.status_code, replay.content), (first.status_code, first.content))
+        self.assertEqual(OrderItem.objects.filter(order__user=self.buyer).count(), 1)
+
+        # новый ключ - новый запрос
+        self.add_to_basket('key-2', product=self.case)
+        self.assertEqual(OrderItem.objects.filter(order__user=self.buyer).count(), 2)
+
+    def test_same_key_other_body(self):
+        self.add_to_basket('key-1')
+        response = self.add_to_basket('key-1', quantity=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(OrderItem.objects.filter(order__user=self.buyer).count(), 1)
+
+    def test_keys_are_per_user(self):
+        other = User.objects.create_user(email='other@example.com', password='secret', is_active=True)
+        self.add_to_basket('key-1')
+        response = self.add_to_basket('key-1', token=Token.objects.create(user=other))
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(OrderItem.objects.filter(order__user=other).count(), 1)
+
+    def test_running_and_abandoned_requests(self):
+        self.add_to_basket('key-1')
+        # первый запрос еще выполняется
+        IdempotencyKey.objects.update(status_code=None, content=None)
+        self.assertEqual(self.add_to_basket('key-1').status_code, 409)
+        # запрос не завершился за IDEMPOTENCY_LEASE - ключ освобождается и запрос выполняется заново
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LEASE + 1))
+        OrderItem.objects.all().delete()
+        response = self.add_to_basket('key-1')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(OrderItem.objects.filter(order__user=self.buyer).count(), 1)
+        self.assertIsNotNone(IdempotencyKey.objects.get().status_code)
+
+class BestOfferTests(TestCase):
+    def test_refresh(self):
+        shop, cheap_shop, closed_shop = create_shop('shop'), create_shop('cheap'), create_shop('closed')
+        Shop.objects.filter(id=closed_shop.id).update(state=False)
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Телефон', category=category)
+        create_offer(shop, product, external_id=1, price='100.00')
+        create_offer(cheap_shop, product, external_id=1, price='90.00')
+        create_offer(closed_shop, product, external_id=1, price='10.00')
+
+        self.assertEqual(refresh_best_offers([product.id]), 1)
+        # повторный пересчет заменяет строку, а не вставляет вторую
+        self.assertEqual(refresh_best_offers([product.id]), 1)
+        best = BestOffer.objects.get()
+        self.assertEqual((best.min_price, best.offer_count), (Decimal('90.00'), 2))
+        self.assertEqual([offer['shop'] for offer in best.top_offers], [cheap_shop.id, shop.id])
+
+
+
+# быстрые сериализаторы должны давать тот же JSON байт в байт, что и сериализаторы DRF
+class FastSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        shop, other_shop = create_shop('shop'), create_shop('other')
+        category = Category.objects.create(name='Смартфоны')
+        phone = Product.objects.create(name='Телефон "X"', category=category)
+        case = Product.objects.create(name='Чехол', category=category)
+        cls.offer = create_offer(shop, phone, external_id=1, price='99999.5')
+        create_offer(other_shop, phone, external_id=1, price='0.01')
+        create_offer(shop, case, external_id=2, price='150')
+        for name, value in (('Цвет', 'черный'), ('Память, Гб', '128')):
+            ProductParameter.objects.create(product=cls.offer, parameter_id=parameter_cache.get_id(name), value=value)
+
+        buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        contact = Contact.objects.create(user=buyer, city='Москва', street='Тверская', house='1', phone='+7900')
+        order = Order.objects.create(user=buyer, status='new', contact=contact)
+        OrderItem.objects.create(order=order, product=phone, shop=shop, quantity=3)
+        OrderItem.objects.create(order=order, product=case, shop=shop, quantity=1)
+        # заказ без контакта и позиций: сумма None
+        Order.objects.create(user=buyer, status='confirmed')
+
+    def assertSameJson(self, serializer, fast_serializer, queryset, fast_queryset):
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(fast_serializer(fast_queryset, many=True).data),
+                         renderer.render(serializer(queryset, many=True).data))
+
+    def test_product_info(self):
+        queryset = ProductInfo.objects.order_by('id')
+        self.assertSameJson(ProductInfoSerializer, FastProductInfoSerializer,
+                            queryset.select_related('product').prefetch_related('product_parameters'), queryset)
+
+    def test_order_item(self):
+        queryset = OrderItem.objects.order_by('id')
+        self.assertSameJson(OrderItemSerializer, FastOrderItemSerializer, queryset, queryset)
+
+    def test_order(self):
+        queryset = Order.objects.with_total_sum().order_by('id')
+        self.assertSameJson(OrderSerializer, FastOrderSerializer,
+                            queryset.select_related('contact').prefetch_related('ordered_items'), queryset)
+
+    def test_single_object(self):
+        queryset = ProductInfo.objects.filter(id=self.offer.id)
+        self.assertEqual(FastJSONRenderer().render(FastProductInfoSerializer(queryset).data),
+                         FastJSONRenderer().render(ProductInfoSerializer(queryset.get()).data))
+
+# данные тестов не закоммичены, реплика-зеркало SQLite их не видит - читаем из основной базы
+@override_settings(DATABASE_REPLICAS=[])
+class PriceChangesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        shop = create_shop('shop')
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Телефон', category=category)
+        # больше одной страницы PAGE_SIZE; каждая третья цена выше прежней
+        PriceHistory.objects.bulk_create([
+            PriceHistory(product=product, shop=shop, category=category, price=Decimal(50 + number),
+                         price_rrc=Decimal(100), old_price=Decimal(100 if number % 3 else 0))
+            for number in range(settings.REST_FRAMEWORK['PAGE_SIZE'] + 5)])
+
+    def get(self, **params):
+        return self.client.get(reverse('price-changes'), dict({'since': '2000-01-01'}, **params))
+
+    def test_cursor_pages(self):
+        first = self.get().json()
+        self.assertNotIn('count', first)
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(second['next'])
+        # записи с одинаковым временем идут от новых к старым по id
+        prices = [row['price'] for row in first['results'] + second['results']]
+        self.assertEqual(prices, [str(price) for price in PriceHistory.objects.order_by('-id').values_list(
+            'price', flat=True)])
+
+    def test_cheaper(self):
+        cheaper = PriceHistory.objects.filter(price__lt=F('old_price')).count()
+        self.assertEqual(len(self.collect(cheaper='yes')), cheaper)
+        self.assertEqual(len(self.collect(cheaper='0')), PriceHistory.objects.count())
+        self.assertFalse(self.get(cheaper='maybe').json()['Status'])
+
+    def collect(self, **params):
+        page = self.get(**params).json()
+        rows = page['results']
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            rows += page['results']
+        return rows
+
+
+# ожидание закрывает соединение с базой, поэтому тесты идут без общей транзакции
+@override_settings(ORDER_FEED_REDIS_URL='', ORDER_FEED_TIMEOUT=0)
+class PartnerOrderFeedTests(TransactionTestCase):
+    def setUp(self):
+        self.shop = create_shop('shop')
+        self.token = Token.objects.create(user=self.shop.user)
+        buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        self.order = create_order(buyer, [self.shop])
+
+    def get(self, after):
+        return self.client.get(reverse('partner-orders-feed'), {'after': after},
+                               HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def take_all_slots(self):
+        taken = 0
+        while stream_slots.acquire(blocking=False):
+            taken += 1
+        self.addCleanup(lambda: [stream_slots.release() for _ in range(taken)])
+
+    def test_long_poll(self):
+        response = self.get(0)
+        self.assertEqual(response.json()['last_id'], self.order.sub_orders.get().id)
+        self.assertEqual(self.get(response.json()['last_id']).json()['orders'], [])
+
+    def test_long_poll_needs_slot_to_wait(self):
+        self.take_all_slots()
+        # уже появившиеся заказы отдаются сразу, без слота
+        self.assertEqual(len(self.get(0).json()['orders']), 1)
+        response = self.get(self.order.sub_orders.get().id)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+class ArchiveOrdersTests(TestCase):
+    def test_total_from_checkout_prices(self):
+        buyer = User.objects.create_user(email='buyer@example.com', password='secret', is_active=True)
+        shop = create_shop('shop')
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Телефон', category=category)
+        offer = create_offer(shop, product, external_id=1, price='100.00')
+        order = Order.objects.create(user=buyer, status='delivered')
+        OrderItem.objects.create(order=order, product=product, shop=shop, quantity=2, price=Decimal('90.00'))
+        SubOrder.objects.create(order=order, shop=shop, subtotal=Decimal('180.00'), delivery_cost=Decimal('15.00'))
+        # заказ без цен в позициях, оформленный до их появления
+        legacy = Order.objects.create(user=buyer, status='canceled')
+        OrderItem.objects.create(order=legacy, product=product, shop=shop, quantity=1)
+        Order.objects.update(dt=timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AGE + 1))
+        # предложение магазина удалено после оформления
+        offer.delete()
+
+        self.assertEqual(archive_orders(), 2)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ArchivedOrder.objects.get(id=order.id).total_sum, Decimal('195.00'))
+        self.assertIsNone(ArchivedOrder.objects.get(id=legacy.id).total_sum)
+        self.assertEqual(ArchivedOrderItem.objects.get(order_id=order.id).price, Decimal('90.00'))
+
+
+FEED = """
+shop: shop
+categories:
+  - id: 1
+    name: Смартфоны
+goods:
+  - id: 7
+    category: 1
+    model: m
+    name: Телефон
+    price: 100
+    price_rrc: 120
+    quantity: 3
+    parameters:
+      Цвет: черный
+""".encode('utf-8')
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/feed.yaml':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(FEED)))
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(SHOP_REFRESH_HOST_DELAY=0)
+class PriceRefreshTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.feed_url = f'http://127.0.0.1:{cls.server.server_port}/feed.yaml'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        self.shop = create_shop('shop')
+
+    def test_refresh_imports_and_clears_mark(self):
+        Shop.objects.filter(id=self.shop.id).update(url=self.feed_url, refresh_started=timezone.now())
+        self.assertEqual(refresh_shop_prices([self.shop.id]), 1)
+        shop = Shop.objects.get(id=self.shop.id)
+        self.assertIsNone(shop.refresh_started)
+        self.assertIsNotNone(shop.last_refresh)
+        self.assertEqual(ProductInfo.objects.get(shop=shop).price, Decimal('100'))
+
+    def test_running_batch_keeps_host_busy(self):
+        # пачка идет дольше двух таймаутов загрузки, но еще не считается зависшей
+        Shop.objects.filter(id=self.shop.id).update(
+            url='http://supplier.example/a.yaml',
+            refresh_started=timezone.now() - timedelta(seconds=settings.SHOP_REFRESH_TIMEOUT * 10))
+        Shop.objects.filter(id=create_shop('other').id).update(url='http://supplier.example/b.yaml')
+        with mock.patch.object(refresh_shop_prices, 'apply_async') as apply_async:
+            self.assertEqual(schedule_price_refresh(), 0)
+            apply_async.assert_not_called()
+
+        Shop.objects.filter(id=self.shop.id).update(
+            refresh_started=timezone.now() - timedelta(seconds=refresh_stale_after() + 1))
+        # зависшая пачка освобождает сервер, оба магазина уходят в одну пачку с паузой между запросами
+        with mock.patch.object(refresh_shop_prices, 'apply_async') as apply_async:
+            self.assertEqual(schedule_price_refresh(), 2)
+        self.assertEqual(sorted(apply_async.call_args[0][0][0]), sorted(Shop.objects.values_list('id', flat=True)))
+
+    def test_bad_url_fails_only_its_shop(self):
+        Shop.objects.filter(id=self.shop.id).update(url=self.feed_url)
+        broken = [create_shop(f'broken{number}') for number in range(3)]
+        for shop, url in zip(broken, ('http://[bad', 'http://exa\tmple.com/', f'{self.feed_url}.missing')):
+            Shop.objects.filter(id=shop.id).update(url=url, refresh_started=timezone.now())
+        self.assertEqual(refresh_shop_prices([self.shop.id] + [shop.id for shop in broken]), 1)
+        self.assertEqual(Shop.objects.filter(refresh_started__isnull=False).count(), 0)
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), 1)
+
+
+@override_settings(TASK_METRICS_REDIS_URL='')
+class CleanupTests(TestCase):
+    def setUp(self):
+        self.old = timezone.now() - timedelta(days=settings.STALE_BASKET_DAYS + 1)
+        self.shop = create_shop('shop')
+        self.product = create_offer(self.shop, Product.objects.create(
+            name='Телефон', category=Category.objects.create(name='Смартфоны')), external_id=1)
+
+    def create_basket(self, email, dt):
+        buyer = User.objects.create_user(email=email, password='secret', is_active=True)
+        basket = Order.objects.basket(buyer.id)
+        OrderItem.objects.create(order=basket, product=self.product.product, shop=self.shop, quantity=1)
+        Order.objects.filter(id=basket.id).update(dt=dt)
+        return buyer, basket
+
+    def test_run_cleanup(self):
+        buyer, stale = self.create_basket('stale@example.com', self.old)
+        _, fresh = self.create_basket('fresh@example.com', timezone.now())
+        ordered = Order.objects.create(user=buyer, status='new')
+        Order.objects.filter(id=ordered.id).update(dt=self.old)
+        old_token = ConfirmEmailToken.objects.create(user=buyer)
+        ConfirmEmailToken.objects.filter(id=old_token.id).update(
+            created_at=timezone.now() - timedelta(hours=settings.CONFIRM_EMAIL_TOKEN_TTL + 1))
+        new_token = ConfirmEmailToken.objects.create(user=buyer)
+        auth_token = Token.objects.create(user=buyer)
+        Token.objects.filter(key=auth_token.key).update(created=self.old)
+
+        results = run_cleanup()
+        self.assertEqual(results['stale_baskets'], {'shop_inter.OrderItem': 1, 'shop_inter.Order': 1})
+        self.assertEqual(results['confirm_email_tokens'], {'shop_inter.ConfirmEmailToken': 1})
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), sorted([fresh.id, ordered.id]))
+        self.assertEqual(list(ConfirmEmailToken.objects.values_list('id', flat=True)), [new_token.id])
+        # токены авторизации не удаляются по времени создания
+        self.assertTrue(Token.objects.filter(key=auth_token.key).exists())
+
+    def test_delete_in_batches_is_bounded(self):
+        for number in range(5):
+            self.create_basket(f'buyer{number}@example.com', self.old)
+        deleted = delete_in_batches(Order.objects.filter(status='basket'), batch_size=2, max_batches=2)
+        self.assertEqual(deleted['shop_inter.Order'], 4)
+        self.assertEqual(Order.objects.filter(status='basket').count(), 1)
+
+
+@override_settings(TASK_METRICS_REDIS_URL='', OUTBOX_BATCH=2)
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('shop_inter.outbox.current_app.send_task')
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent(self):
+        return [(call.args[0], call.kwargs['kwargs']) for call in self.send_task.call_args_list]
+
+    def test_publish_is_transactional(self):
+        with self.assertRaises(ValueError):
+            publish('order.unknown', order_id=1)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            publish('order.status_changed', order_id=1, status='sent')
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_relay_all_pending_in_batches(self):
+        publish('order.placed', order_id=1, user_id=2)
+        for order_id in range(2, 6):
+            publish('order.status_changed', order_id=order_id, status='sent')
+        self.assertEqual(outbox_stats()['pending'], 5)
+
+        self.assertEqual(relay_pending(60), 5)
+        self.assertEqual(self.sent()[:3], [
+            ('shop_inter.tasks.broadcast_new_order', {'order_id': 1, 'user_id': 2}),
+            ('shop_inter.tasks.notify_order_placed', {'order_id': 1, 'user_id': 2}),
+            ('shop_inter.tasks.notify_status_changed', {'order_id': 2, 'status': 'sent'}),
+        ])
+        self.assertEqual(len(self.sent()), 6)
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+        # повторный запуск ничего не отправляет
+        self.assertEqual(relay_pending(60), 0)
+        self.assertEqual(len(self.sent()), 6)
+
+    def test_broker_error_keeps_batch_pending(self):
+        publish('order.status_changed', order_id=1, status='sent')
+        publish('order.status_changed', order_id=2, status='sent')
+        self.send_task.side_effect = [None, ConnectionError]
+        with self.assertRaises(ConnectionError):
+            relay_pending(60)
+        # пачка не отмечена и уйдет повторно целиком
+        self.assertEqual(outbox_stats()['pending'], 2)
+        self.send_task.side_effect = None
+        self.assertEqual(relay_pending(60), 2)
+        # отправка первого события повторяется: доставка at-least-once
+        self.assertEqual([kwargs['order_id'] for _, kwargs in self.sent()], [1, 2, 1, 2])
+
+    def test_unknown_topic_is_skipped(self):
+        OutboxEvent.objects.create(topic='removed.topic', payload={})
+        publish('email', subject='Заказ', message='Принят', recipient_list=['buyer@example.com'])
+        self.assertEqual(relay_pending(60), 2)
+        self.assertEqual([task for task, _ in self.sent()], ['shop_inter.tasks.send_email'])
+        self.assertEqual(outbox_stats()['pending'], 0)
+
+
+# данные тестов не закоммичены, реплика-зеркало SQLite их не видит - читаем из основной базы
+@override_settings(EXPORT_BATCH=1, DATABASE_REPLICAS=[])
+class ExportSnapshotTests(TestCase):
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(EXPORT_DIR=os.path.join(directory.name, 'export'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        shop, closed_shop = create_shop('shop'), create_shop('closed')
+        Shop.objects.filter(id=closed_shop.id).update(state=False)
+        category = Category.objects.create(name='Смартфоны')
+        phone = Product.objects.create(name='Телефон, "X"', category=category)
+        case = Product.objects.create(name='Чехол', category=category)
+        self.offer = create_offer(shop, phone, external_id=1, price='99.5')
+        create_offer(shop, case, external_id=2)
+        create_offer(closed_shop, phone, external_id=1)
+        ProductParameter.objects.create(product=self.offer, parameter_id=parameter_cache.get_id('Цвет'),
+                                        value='черный')
+
+    def read(self, path):
+        with open(path, encoding='utf-8', newline='') as file:
+            return file.read()
+
+    def test_csv_snapshot(self):
+        path = export.build_snapshot('csv', 'v1')
+        self.assertEqual(path, export.snapshot_path('csv', 'v1'))
+        rows = list(csv.DictReader(self.read(path).splitlines()))
+        # только открытые магазины, параметры - отдельными столбцами
+        self.assertEqual([row['name'] for row in rows], ['Телефон, "X"', 'Чехол'])
+        self.assertEqual((rows[0]['price'], rows[0]['category'], rows[0]['Цвет']), ('99.50', 'Смартфоны', 'черный'))
+        self.assertEqual(rows[1]['Цвет'], '')
+
+    def test_ndjson_snapshot_matches_stream(self):
+        path = export.build_snapshot('ndjson', 'v1')
+        lines = [json.loads(line) for line in self.read(path).splitlines()]
+        self.assertEqual([line['id'] for line in lines], sorted(
+            ProductInfo.objects.filter(shop__state=True).values_list('id', flat=True)))
+        self.assertEqual(lines[0]['parameters'], {'Цвет': 'черный'})
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b''.join(export.stream('ndjson')))
+
+    def test_new_version_replaces_old(self):
+        old_path = export.build_snapshot('csv', 'v1')
+        ndjson_path = export.build_snapshot('ndjson', 'v1')
+        # снимок существующей версии не перестраивается
+        with mock.patch('shop_inter.export.write_file') as write_file:
+            self.assertEqual(export.build_snapshot('csv', 'v1'), old_path)
+            write_file.assert_not_called()
+
+        ProductInfo.objects.filter(id=self.offer.id).update(price=Decimal('10'))
+        new_path = export.build_snapshot('csv', 'v2')
+        self.assertFalse(os.path.exists(old_path))
+        self.assertIn('10.00', self.read(new_path))
+        # снимки других форматов не трогаются
+        self.assertTrue(os.path.exists(ndjson_path))
+
+    def test_failed_build_leaves_no_file(self):
+        with mock.patch('shop_inter.export.iter_batches', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            export.build_snapshot('csv', 'v1')
+        self.assertEqual(os.listdir(settings.EXPORT_DIR), [])
+
+    def test_view_serves_snapshot(self):
+        token = Token.objects.create(user=User.objects.get(email='shop@example.com'))
+        version = catalog_version()
+        path = export.build_snapshot('csv', version)
+        url = reverse('catalog-export', args=['csv'])
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response['ETag'], f'"{version}"')
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8'), self.read(path))
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IF_NONE_MATCH=f'"{version}"')
+        self.assertEqual(response.status_code, 304)
+
+
+@celery_app.task(name='shop_inter.tests.divide')
+def divide(x, y):
+    return x / y
+
+
+class TaskMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.client_mock = mock.MagicMock()
+        self.pipe = self.client_mock.pipeline.return_value
+        patcher = mock.patch.object(task_metrics, 'get_client', return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_signals_record_outcome(self):
+        with mock.patch.object(task_metrics, 'observe') as observe:
+            self.assertEqual(divide.apply(args=(6, 3)).get(), 2)
+            divide.apply(args=(1, 0))
+        (name, state, runtime, wait), _ = observe.call_args_list[0]
+        self.assertEqual((name, state, wait), ('shop_inter.tests.divide', 'SUCCESS', None))
+        self.assertGreaterEqual(runtime, 0)
+        self.assertEqual(observe.call_args_list[1][0][1], 'FAILURE')
+
+    def test_queue_wait(self):
+        headers = {}
+        mark_published(headers)
+        request = mock.Mock(enqueued_at=None, headers=headers, eta=None)
+        self.assertAlmostEqual(queue_wait(request, headers['enqueued_at'] + 5), 5)
+        # отложенная задача ждет с момента, когда ее можно было начать
+        eta = timezone.now().replace(microsecond=0)
+        request = mock.Mock(enqueued_at=eta.timestamp() - 60, headers=None, eta=eta.isoformat())
+        self.assertAlmostEqual(queue_wait(request, eta.timestamp() + 2), 2)
+        self.assertIsNone(queue_wait(mock.Mock(enqueued_at=None, headers=None), 0))
+
+    def test_observe_buckets(self):
+        task_metrics.observe('task', 'SUCCESS', 0.3, None)
+        key = 'celery:metrics:task'
+        self.pipe.sadd.assert_called_once_with('celery:metrics:tasks', 'task')
+        self.pipe.hincrby.assert_any_call(key, 'state:SUCCESS', 1)
+        self.pipe.hincrbyfloat.assert_called_once_with(key, 'runtime:sum', 0.3)
+        buckets = [call.args[1] for call in self.pipe.hincrby.call_args_list if ':le:' in call.args[1]]
+        self.assertEqual(buckets, [f'runtime:le:{bound}' for bound in settings.TASK_METRICS_BUCKETS if bound >= 0.3])
+        self.pipe.execute.assert_called_once_with()
+
+    def test_redis_errors_do_not_fail_tasks(self):
+        self.pipe.execute.side_effect = redis.RedisError
+        with self.assertLogs('shop_inter.task_metrics', 'WARNING'):
+            task_metrics.observe('task', 'SUCCESS', 0.3, 1.0)
+
+    def test_render_prometheus(self):
+        fields = {'state:SUCCESS': '3', 'state:FAILURE': '1', 'runtime:sum': '1.5', 'runtime:count': '4'}
+        fields.update({f'runtime:le:{bound}': '4' for bound in settings.TASK_METRICS_BUCKETS if bound >= 1})
+        with mock.patch.object(task_metrics, 'tasks', return_value={'task': fields}), \
+                mock.patch.object(task_metrics, 'queues', return_value={'mail': 2}):
+            lines = render_prometheus().splitlines()
+        self.assertIn('celery_task_total{task="task",state="SUCCESS"} 3', lines)
+        self.assertIn('celery_task_runtime_seconds_bucket{task="task",le="0.5"} 0', lines)
+        self.assertIn('celery_task_runtime_seconds_bucket{task="task",le="1"} 4', lines)
+        self.assertIn('celery_task_runtime_seconds_bucket{task="task",le="+Inf"} 4', lines)
+        self.assertIn('celery_task_runtime_seconds_count{task="task"} 4', lines)
+        self.assertIn('celery_queue_length{queue="mail"} 2', lines)
+        # ожидание в очереди не измерялось - гистограммы нет
+        self.assertFalse([line for line in lines if line.startswith('celery_task_queue_wait_seconds_')])
+
+    def test_without_redis(self):
+        with mock.patch.object(task_metrics, 'get_client', return_value=None):
+            task_metrics.observe('task', 'SUCCESS', 0.3, None)
+            self.assertEqual(task_metrics.tasks(), {})
+        self.client_mock.pipeline.assert_not_called()
@@ -0,0 +1,188 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+try:
+    from django_redis import get_redis_connection
+except ImportError:
+    get_redis_connection = None
+
+# проверка и списание токенов одним вызовом в redis, без гонок между процессами.
+# Числа возвращаются строками: lua отбрасывает дробную часть у чисел в ответе
+BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or capacity
+local stamp = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - stamp) * rate)
+if tokens < cost then
+    return {0, tostring((cost - tokens) / rate)}
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'stamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return {1, '0'}
+"""
+
+
+class LocalBuckets:
+    """
+    Хранилище корзин в памяти процесса, используется при недоступности общего кеша
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            if len(self.data) > 10000:
+                self.data.clear()
+            self.data[key] = value
+
+
+local_buckets = LocalBuckets()
+# без redis чтение и запись корзины в процессе выполняются под блокировкой
+bucket_lock = threading.Lock()
+_bucket_script = None
+
+
+def redis_client():
+    """
+    Клиент redis общего кеша, если кеш настроен на django-redis (CACHE_URL=rediscache://...)
+    """
+    if get_redis_connection is None:
+        return None
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Ограничение частоты запросов по алгоритму token bucket.
+    Корзина своя для каждого пользователя (или IP) и класса эндпоинтов (throttle_scope представления),
+    запрос списывает throttle_cost токенов.
+    С кешем на redis корзина проверяется и списывается атомарно скриптом lua, общим для всех процессов;
+    с другим кешем - под блокировкой процесса
+    """
+
+    def get_bucket(self, view):
+        scope = getattr(view, 'throttle_scope', None) or 'default'
+        buckets = settings.RATE_LIMIT_BUCKETS
+        return scope, buckets.get(scope, buckets['default'])
+
+    def get_cache_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return f'throttle:{scope}:{ident}'
+
+    def load(self, key):
+        try:
+            return cache.get(key), cache
+        except Exception:
+            return local_buckets.get(key), local_buckets
+
+    def allow_request(self, request, view):
+        scope, bucket = self.get_bucket(view)
+        capacity, rate = bucket['capacity'], bucket['rate']
+        cost = getattr(view, 'throttle_cost', 1)
+        key = self.get_cache_key(request, scope)
+        now = time.time()
+        timeout = int(capacity / rate) + 1
+
+        self.wait_seconds = None
+        client = redis_client()
+        if client is not None:
+            try:
+                allowed, wait = self.take_redis(client, cache.make_key(key), capacity, rate, cost, now, timeout)
+            except Exception:
+                pass
+            else:
+                if not allowed:
+                    self.wait_seconds = wait
+                return allowed
+
+        with bucket_lock:
+            state, storage = self.load(key)
+            tokens, stamp = state if state else (capacity, now)
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens < cost:
+                self.wait_seconds = (cost - tokens) / rate
+                return False
+            try:
+                storage.set(key, (tokens - cost, now), timeout)
+            except Exception:
+                local_buckets.set(key, (tokens - cost, now), timeout)
+        return True
+
+    @staticmethod
+    def take_redis(client, key, capacity, rate, cost, now, timeout):
+        global _bucket_script
+        if _bucket_script is None:
+            _bucket_script = client.register_script(BUCKET_SCRIPT)
+        allowed, wait = _bucket_script(keys=[key], args=[capacity, rate, cost, now, timeout], client=client)
+        return bool(int(allowed)), float(wait)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class Overloaded(APIException):
+    status_code = 503
+    default_detail = 'Сервис перегружен, повторите запрос позже'
+    default_code = 'overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+class DatabaseLatency:
+    """
+    Сглаженная задержка ответа базы, измеряется в процессе не чаще LOAD_SHED_CHECK_INTERVAL
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self.checked = 0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self.checked >= settings.LOAD_SHED_CHECK_INTERVAL:
+            self.checked = now
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            self.value = 0.7 * self.value + 0.3 * (time.perf_counter() - started)
+        return self.value
+
+
+db_latency = DatabaseLatency()
+
+
+class LoadSheddingThrottle(BaseThrottle):
+    """
+    При высокой задержке базы отклоняет дорогие запросы (throttle_cost >= LOAD_SHED_MIN_COST) с кодом 503
+    """
+
+    def allow_request(self, request, view):
+        if getattr(view, 'throttle_cost', 1) < settings.LOAD_SHED_MIN_COST:
+            return True
+        if db_latency.get() > settings.LOAD_SHED_DB_LATENCY:
+            raise Overloaded(settings.LOAD_SHED_RETRY_AFTER)
+        return True
@@ -0,0 +1,184 @@
+import math
+from collections import Counter
+
+from django.conf import settings
+
+from shop_inter.models import Category
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+REQUIRED_KEYS = ('shop', 'categories', 'goods')
+REQUIRED_GOODS_KEYS = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity', 'parameters')
+MAX_PRICE = 1e18
+MAX_INTEGER = 2 ** 31
+
+# сообщения проверок строк в порядке их выполнения, одинаковые для обоих способов проверки
+MESSAGES = {
+    'missing': 'Обязательное поле',
+    'id': 'Ожидается целое число не меньше 0',
+    'price': 'Ожидается число не меньше 0',
+    'price_rrc': 'Ожидается число не меньше 0',
+    'quantity': 'Ожидается целое число не меньше 0',
+    'category': 'Неизвестная категория',
+    'parameters': 'Ожидается словарь параметров',
+    'duplicate_id': 'Повторяется внешний ИД',
+    'duplicate_product': 'Повторяется товар (название, категория, модель)',
+}
+CHECK_ORDER = {check: number for number, check in enumerate(MESSAGES)}
+
+
+class FeedValidationError(ValueError):
+    """
+    Прайс не прошел проверку, report - отчет validate_price
+    """
+
+    def __init__(self, report):
+        super().__init__(f'Ошибок в прайсе: {report["error_count"]}')
+        self.report = report
+
+
+def is_missing(value):
+    # NaN из json.loads считается пропуском, как и в pandas
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def to_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def is_count(value):
+    number = to_number(value)
+    return number is not None and number.is_integer() and 0 <= number < MAX_INTEGER
+
+
+def is_price(value):
+    number = to_number(value)
+    return number is not None and 0 <= number < MAX_PRICE
+
+
+def product_key(item):
+    return tuple(str(item.get(key)) for key in ('name', 'category', 'model'))
+
+
+def check_rows(rows, known_categories):
+    """
+    Построчная проверка товаров, используется без pandas.
+    rows - список (номер строки, товар); возвращает (номер строки, проверка, поле)
+    """
+    found = []
+    ids = Counter(int(to_number(item['id'])) for _, item in rows if is_count(item.get('id')))
+    products = Counter(product_key(item) for _, item in rows)
+    for row, item in rows:
+        missing = {key for key in REQUIRED_GOODS_KEYS if is_missing(item.get(key))}
+        found.extend((row, 'missing', key) for key in REQUIRED_GOODS_KEYS if key in missing)
+        if 'id' not in missing and not is_count(item['id']):
+            found.append((row, 'id', 'id'))
+        for field in ('price', 'price_rrc'):
+            if field not in missing and not is_price(item[field]):
+                found.append((row, field, field))
+        if 'quantity' not in missing and not is_count(item['quantity']):
+            found.append((row, 'quantity', 'quantity'))
+        if 'category' not in missing and to_number(item['category']) not in known_categories:
+            found.append((row, 'category', 'category'))
+        if 'parameters' not in missing and not isinstance(item['parameters'], dict):
+            found.append((row, 'parameters', 'parameters'))
+        if is_count(item.get('id')) and ids[int(to_number(item['id']))] > 1:
+            found.append((row, 'duplicate_id', 'id'))
+        if products[product_key(item)] > 1:
+            found.append((row, 'duplicate_product', 'name'))
+    return found
+
+
+def check_columns(rows, known_categories):
+    """
+    Та же проверка столбцами pandas: на больших прайсах в разы быстрее построчной
+    """
+    frame = pandas.DataFrame.from_records([item for _, item in rows], index=[row for row, _ in rows])
+    for key in REQUIRED_GOODS_KEYS:
+        if key not in frame:
+            frame[key] = None
+    found = []
+
+    def add(mask, check, field):
+        found.extend((row, check, field) for row in frame.index[mask.to_numpy(dtype=bool)])
+
+    for key in REQUIRED_GOODS_KEYS:
+        add(frame[key].isna(), 'missing', key)
+
+    numbers = {key: pandas.to_numeric(frame[key], errors='coerce') for key in ('id', 'price', 'price_rrc', 'quantity')}
+    valid = {}
+    for key in ('id', 'quantity'):
+        number = numbers[key]
+        valid[key] = number.notna() & (number % 1 == 0) & (number >= 0) & (number < MAX_INTEGER)
+    for key in ('price', 'price_rrc'):
+        number = numbers[key]
+        valid[key] = number.notna() & (number >= 0) & (number < MAX_PRICE)
+    for key in ('id', 'price', 'price_rrc', 'quantity'):
+        add(frame[key].notna() & ~valid[key], key, key)
+
+    category = pandas.to_numeric(frame['category'], errors='coerce')
+    add(frame['category'].notna() & ~category.isin(known_categories), 'category', 'category')
+    add(frame['parameters'].notna() & ~frame['parameters'].map(lambda value: isinstance(value, dict)),
+        'parameters', 'parameters')
+    add(valid['id'] & numbers['id'].where(valid['id']).duplicated(keep=False), 'duplicate_id', 'id')
+    # ключ товара строится из исходных значений: pandas приводит целые столбцы с пропусками к float
+    products = pandas.Series([product_key(item) for _, item in rows], index=frame.index)
+    add(products.duplicated(keep=False), 'duplicate_product', 'name')
+    return found
+
+
+def validate_price(data):
+    """
+    Проверка всего прайса до записи в базу: обязательные поля, числовые диапазоны,
+    неизвестные категории и повторы. Возвращает отчет с ошибками по строкам товаров
+    """
+    errors = []
+    if not isinstance(data, dict):
+        data = {}
+    for key in REQUIRED_KEYS:
+        if not data.get(key):
+            errors.append({'row': None, 'external_id': None, 'field': key, 'error': MESSAGES['missing']})
+
+    categories = data.get('categories') if isinstance(data.get('categories'), list) else []
+    known_categories = set()
+    for category in categories:
+        if isinstance(category, dict) and is_count(category.get('id')) and category.get('name'):
+            known_categories.add(int(to_number(category['id'])))
+        else:
+            errors.append({'row': None, 'external_id': None, 'field': 'categories',
+                           'error': f'Неверная категория {category}'})
+
+    goods = data.get('goods') if isinstance(data.get('goods'), list) else []
+    rows = []
+    for row, item in enumerate(goods):
+        if isinstance(item, dict):
+            rows.append((row, item))
+        else:
+            errors.append({'row': row, 'external_id': None, 'field': None, 'error': 'Ожидается объект'})
+
+    # категории, не описанные в прайсе, допустимы, если уже есть в каталоге
+    undeclared = {int(number) for number in (to_number(item.get('category')) for _, item in rows)
+                  if number is not None and number.is_integer()} - known_categories
+    if undeclared:
+        known_categories |= set(Category.objects.filter(id__in=undeclared).values_list('id', flat=True))
+
+    if rows:
+        check = check_columns if pandas is not None else check_rows
+        found = check(rows, known_categories)
+        found.sort(key=lambda error: (error[0], CHECK_ORDER[error[1]]))
+        errors.extend({'row': int(row), 'external_id': goods[row].get('id'), 'field': field,
+                       'error': MESSAGES[check_name]} for row, check_name, field in found)
+
+    return {
+        'valid': not errors,
+        'rows': len(goods),
+        'error_count': len(errors),
+        'errors': errors[:settings.FEED_MAX_ERRORS],
+    }
@@ -1,36 +1,86 @@
-from distutils.util import strtobool
+from datetime import datetime, time, timedelta
+from time import monotonic
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F, DecimalField
+from django.db import IntegrityError, transaction, connection
+from django.db.models import Q, F, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import etag
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from json import loads as load_json
 from json import dumps
 from django.core.validators import URLValidator
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from rest_framework.views import APIView
-from yaml import load as load_yaml, Loader
-from requests import get
 from shop_inter.models import Shop, Category, ProductInfo, Product, ProductParameter, Parameter, Order, \
-    OrderItem, Contact, ConfirmEmailToken
+    OrderItem, Contact, ConfirmEmailToken, ArchivedOrder, PriceHistory, \
+    BestOffer, SubOrder, PriceImport, ShopSalesDaily, ProductSalesDaily, CategorySalesDaily
 from shop_inter.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer, ProductSerializer
+    OrderItemSerializer, OrderSerializer, ContactSerializer, ProductSerializer, ArchivedOrderSerializer, \
+    PriceHistorySerializer
+from shop_inter.etags import products_etag, categories_etag, shops_etag, catalog_version, invalidate_catalog
+from shop_inter.export import available_formats, snapshot_path, stream as export_stream, CONTENT_TYPES
+from shop_inter.idempotency import idempotent
+from shop_inter.importer import apply_deltas
+from shop_inter.checkout import price_order, UnavailableItems
+from shop_inter.analytics import record_sales, shop_report, top_report
+from shop_inter.order_status import transition_orders, allowed_sources
+from shop_inter.fast_serializers import FastProductInfoSerializer, FastOrderSerializer, FastPartnerOrderSerializer, \
+    price_to_str
+from shop_inter.renderers import stream_list, dumps, FastJSONRenderer, EventStreamRenderer
+from shop_inter.routers import get_read_alias
+from shop_inter.feed import order_feed, stream_slots, SlotStream
+from shop_inter.task_metrics import render_prometheus
 from shop_inter.signals import new_user_registered, new_order, shop_notification
-from shop_inter.tasks import new_order_func, new_order_shop
+from shop_inter.tasks import import_shop_price, build_catalog_snapshots
+from shop_inter.outbox import publish
 from rest_framework import viewsets
 from django_filters.rest_framework import DjangoFilterBackend
 
 
+def parse_bool(value):
+    """
+    Логический параметр запроса, значения как у distutils.util.strtobool (distutils удален в Python 3.12)
+    """
+    value = str(value).lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    raise ValueError(f'Неверное логическое значение {value}')
+
+
 class PartnerUpdate(APIView):
     """
     Класс для обновления прайса от поставщика
     """
+    throttle_scope = 'partner_update'
+    throttle_cost = 50
+
+    # результат загрузки прайса с отчетом проверки
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        imports = PriceImport.objects.filter(user_id=request.user.id)
+        if request.query_params.get('id'):
+            if not request.query_params['id'].isdigit():
+                return JsonResponse({'Status': False, 'Errors': 'Неправильно указан id загрузки'})
+            imports = imports.filter(id=request.query_params['id'])
+        return JsonResponse({'Status': True, 'Imports': list(imports.values(
+            'id', 'shop_id', 'url', 'status', 'report', 'created_at', 'finished_at')[:10])})
+
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -46,36 +96,57 @@ class PartnerUpdate(APIView):
             except ValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                stream = get(url).content
-                data = load_yaml(stream, Loader=Loader)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-                for category in data['categories']:
-                    category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_object.shops.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'], model=item['model'])
-
-                    product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'],
-                                                              quantity=item['quantity'],
-                                                              shop_id=shop.id)
-                    for name, value in item['parameters'].items():
-                        parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(product_id=product_info.id,
-                                                        parameter_id=parameter_object.id,
-                                                        value=value)
+                # загрузка прайса не занимает обработчик запроса на время ответа поставщика,
+                # отчет о проверке и результат доступны по id загрузки
+                record = PriceImport.objects.create(user_id=request.user.id, url=url)
+                task = import_shop_price.delay(url, request.user.id, record.id)
 
-                return JsonResponse({'Status': True})
+                return JsonResponse({'Status': True, 'Task': task.id, 'Import': record.id})
 
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы', 'url': url})
 
 
+class PartnerDeltas(APIView):
+    """
+    Класс для частичного обновления цен и остатков поставщиком без загрузки всего прайса
+    """
+    throttle_scope = 'partner_update'
+    throttle_cost = 10
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        items = request.data.get('items')
+        if isinstance(items, str):
+            try:
+                items = load_json(items)
+            except ValueError:
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
+        if not items or not isinstance(items, list):
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        if len(items) > settings.PARTNER_DELTA_MAX_ITEMS:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Не более {settings.PARTNER_DELTA_MAX_ITEMS} изменений за запрос'})
+
+        shops = Shop.objects.filter(user_id=request.user.id)
+        if request.data.get('shop'):
+            if not str(request.data['shop']).isdigit():
+                return JsonResponse({'Status': False, 'Errors': 'Неправильно указан магазин'})
+            shops = shops.filter(id=request.data['shop'])
+        shop_ids = list(shops.values_list('id', flat=True)[:2])
+        if len(shop_ids) != 1:
+            return JsonResponse({'Status': False, 'Errors': 'Укажите магазин'})
+
+        results = apply_deltas(shop_ids[0], items)
+        return JsonResponse({'Status': True,
+                             'Updated': sum(1 for result in results if result['Status']),
+                             'Results': results})
+
+
 class RegisterAccount(APIView):
     """
     Для регистрации покупателей
@@ -103,11 +174,12 @@ class RegisterAccount(APIView):
                 request.data.update({})
                 user_serializer = UserSerializer(data=request.data)
                 if user_serializer.is_valid():
-                    # сохраняем пользователя
-                    user = user_serializer.save()
-                    user.set_password(request.data['password'])
-                    user.save()
-                    new_user_registered.send(sender=self.__class__, user_id=user.id)
+                    # сохраняем пользователя вместе с письмом подтверждения в outbox
+                    with transaction.atomic():
+                        user = user_serializer.save()
+                        user.set_password(request.data['password'])
+                        user.save()
+                        new_user_registered.send(sender=self.__class__, user_id=user.id)
                     return JsonResponse({'Status': True})
                 else:
                     return JsonResponse({'Status': False, 'Errors': user_serializer.errors})
@@ -201,18 +273,24 @@ class LoginAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+@method_decorator(etag(categories_etag), name='get')
 class CategoryView(ListAPIView):
     """
     Класс для просмотра категорий
     """
+    replica_reads = True
+    throttle_scope = 'catalog'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
+@method_decorator(etag(shops_etag), name='get')
 class ShopView(ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
+    replica_reads = True
+    throttle_scope = 'catalog'
     # queryset = Shop.objects.filter(state=True)
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
@@ -246,21 +324,139 @@ class ShopView(ListAPIView):
 #         return Response(serializer.data)
 
 class ProductView(viewsets.ViewSet):
+    replica_reads = True
+    throttle_scope = 'catalog'
+    throttle_cost = 5
     permission_classes = [AllowAny]
     query = Q(shop__state=True)
     queryset = ProductInfo.objects.filter(query)
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['product__category', 'shop']
 
+    @method_decorator(etag(products_etag))
     def list(self, request):
-        serializer = ProductInfoSerializer(self.queryset, many=True)
+        if request.accepted_renderer.format == 'json':
+            return stream_list(FastProductInfoSerializer, self.queryset.all())
+        serializer = FastProductInfoSerializer(self.queryset.all(), many=True)
         return Response(serializer.data)
 
+    @method_decorator(etag(products_etag))
     def retrieve(self, request, pk=None):
         item = get_object_or_404(self.queryset, pk=pk)
         serializer = ProductInfoSerializer(item)
         return Response(serializer.data)
 
+class CatalogExport(APIView):
+    """
+    Класс для выгрузки всего активного каталога в csv, ndjson или parquet.
+    Пока каталог не менялся, отдается готовый снимок; иначе снимок строится в фоне,
+    а csv и ndjson тем временем отдаются потоком
+    """
+    replica_reads = True
+    throttle_scope = 'catalog'
+    throttle_cost = 50
+
+    def get(self, request, export_format, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if export_format not in available_formats():
+            return JsonResponse({'Status': False, 'Errors': f'Доступные форматы: {", ".join(available_formats())}'},
+                                status=404)
+
+        version = catalog_version()
+        etag = f'"{version}"'
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            return HttpResponse(status=304)
+
+        filename = f'catalog-{version}.{export_format}'
+        path = snapshot_path(export_format, version)
+        try:
+            response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename,
+                                    content_type=CONTENT_TYPES[export_format])
+        except FileNotFoundError:
+            # снимок этой версии строит одна задача на всех клиентов
+            if cache.add(f'export:{export_format}:{version}', True, settings.EXPORT_BUILD_TIMEOUT):
+                build_catalog_snapshots.delay([export_format])
+            if export_format == 'parquet':
+                response = JsonResponse({'Status': False, 'Error': 'Выгрузка готовится, повторите запрос позже'},
+                                        status=503)
+                response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+                return response
+            response = StreamingHttpResponse(export_stream(export_format, get_read_alias()),
+                                             content_type=CONTENT_TYPES[export_format])
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['ETag'] = etag
+        return response
+
+
+class PriceChangesPagination(CursorPagination):
+    """
+    Страницы истории цен по курсору (changed_at, id): без COUNT(*) и OFFSET по сотням миллионов строк
+    """
+    ordering = ('-changed_at', '-id')
+
+
+class PriceChangesView(ListAPIView):
+    """
+    Класс для получения изменений цен с момента since по категории и/или магазину, от новых к старым
+    """
+    replica_reads = True
+    throttle_scope = 'catalog'
+    serializer_class = PriceHistorySerializer
+    pagination_class = PriceChangesPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        query = Q(changed_at__gte=self.since)
+        if params.get('category_id'):
+            query = query & Q(category_id=params['category_id'])
+        if params.get('shop_id'):
+            query = query & Q(shop_id=params['shop_id'])
+        if self.cheaper:
+            query = query & Q(price__lt=F('old_price'))
+        return PriceHistory.objects.filter(query)
+
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since', '')
+        try:
+            self.since = parse_datetime(since)
+            if self.since is None and parse_date(since):
+                self.since = datetime.combine(parse_date(since), time.min)
+        except ValueError:
+            self.since = None
+        if not self.since:
+            return JsonResponse({'Status': False, 'Errors': 'Не указан или неверно указан параметр since'})
+        for name in ('category_id', 'shop_id'):
+            if not request.query_params.get(name, '0').isdigit():
+                return JsonResponse({'Status': False, 'Errors': f'Неверно указан параметр {name}'})
+        try:
+            self.cheaper = parse_bool(request.query_params.get('cheaper', 'false'))
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверно указан параметр cheaper'})
+        return super().get(request, *args, **kwargs)
+
+
+class OffersView(APIView):
+    """
+    Класс для сравнения предложений магазинов по продуктам
+    """
+    replica_reads = True
+    throttle_scope = 'catalog'
+
+    def get(self, request, *args, **kwargs):
+        items_sting = request.query_params.get('products', '')
+        product_ids = [product_id for product_id in items_sting.split(',') if product_id.isdigit()]
+        if not product_ids or len(product_ids) > settings.BEST_OFFERS_MAX_PRODUCTS:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        offers = BestOffer.objects.filter(product_id__in=product_ids).values(
+            'product_id', 'min_price', 'offer_count', 'top_offers')
+        return Response([{'product': offer['product_id'],
+                          'min_price': price_to_str(offer['min_price']),
+                          'offer_count': offer['offer_count'],
+                          'offers': offer['top_offers']} for offer in offers])
+
+
 class BasketView(APIView):
     """
     Класс для работы с корзиной пользователя
@@ -271,15 +467,13 @@ class BasketView(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
         basket = Order.objects.filter(
-            user_id=request.user.id, status='basket').prefetch_related(
-            'orderitems__product__category',
-            'orderitems__product__product_info__product_parameters__parameter').annotate(
-            total_sum = Sum(F('orderitems__quantity') * F('orderitems__product__product_info__price'), output_field=DecimalField())).distinct()
+            user_id=request.user.id, status='basket').with_total_sum()
 
-        serializer = OrderSerializer(basket, many=True)
+        serializer = FastOrderSerializer(basket, many=True)
         return Response(serializer.data)
 
     # редактировать корзину
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -287,14 +481,15 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting and type(items_sting) == list:
              try:
-                 basket, _ = Order.objects.update_or_create(user_id=request.user.id, status='basket')
+                 basket = Order.objects.basket(request.user.id)
+                 # время корзины - последнее изменение, по нему очищаются брошенные корзины
+                 Order.objects.filter(id=basket.id).update(dt=timezone.now())
                  objects_created = 0
                  for num in items_sting:
                      serializer = OrderItemSerializer(data=num)
                      if serializer.is_valid():
                          try:
-                             obj = serializer.save()
-                             basket.orderitems.add(obj)
+                             serializer.save(order=basket)
                              objects_created += 1
                          except IntegrityError as error:
                              return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -307,21 +502,19 @@ class BasketView(APIView):
             return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
     # удалить товары из корзины
+    @idempotent
     def delete(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
         items_sting = request.data.get('items')
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-        print(basket.orderitems.prefetch_related().filter(product=1))
         if type(items_sting)==dict:
             try:
                 serializer = OrderItemSerializer(data=items_sting)
                 if serializer.is_valid():
                     try:
-                        basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-                        if basket.orderitems.prefetch_related().filter(product=items_sting['product']):
-                            deleted_count = basket.orderitems.prefetch_related().filter(product=items_sting['product']).delete()[0]
-                            # basket.orderitems.prefetch_related().filter(product=items_sting['product']).delete()[0]
+                        basket = Order.objects.basket(request.user.id)
+                        deleted_count = basket.ordered_items.filter(product=items_sting['product']).delete()[0]
+                        if deleted_count:
                             return JsonResponse({'Status': True, 'Удалено предметов': deleted_count})
                         else:
                             return JsonResponse({'Status': False, 'Errors': 'Такого продукта нет'})
@@ -334,17 +527,17 @@ class BasketView(APIView):
             return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
 
     # изменить количество для позиции в корзине
+    @idempotent
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
         items_sting = request.data.get('items')
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-        objects_updated = 0
-        print(basket.orderitems.all().values_list('id',flat=True))
-        if basket.orderitems.filter(id=items_sting['orderitem_id']).exists():
-            objects_updated += OrderItem.objects.filter(id=items_sting['orderitem_id']).update(
-                quantity=items_sting['quantity'])
+        basket = Order.objects.basket(request.user.id)
+        Order.objects.filter(id=basket.id).update(dt=timezone.now())
+        objects_updated = basket.ordered_items.filter(id=items_sting['orderitem_id']).update(
+            quantity=items_sting['quantity'])
+        if objects_updated:
             return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated})
         else:
             return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
@@ -376,7 +569,11 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                with transaction.atomic():
+                    Shop.objects.filter(user_id=request.user.id).update(state=parse_bool(state))
+                    invalidate_catalog()
+                    publish('shop.state_changed', shop_ids=list(Shop.objects.filter(
+                        user_id=request.user.id).values_list('id', flat=True)))
                 return JsonResponse({'Status': True})
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -388,6 +585,10 @@ class PartnerOrders(APIView):
     """
     Класс для получения заказов поставщиками
     """
+    replica_reads = True
+    throttle_scope = 'orders'
+    throttle_cost = 5
+
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -395,16 +596,140 @@ class PartnerOrders(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
-        order = Order.objects.filter(
-            orderitems__shop__user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'orderitems__product__category',
-            'orderitems__product__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('orderitems__quantity') * F('orderitems__product__product_info__price'), output_field=DecimalField())).distinct()
+        sub_orders = SubOrder.objects.filter(
+            shop__user_id=request.user.id).exclude(order__status='basket').order_by('-order__dt')
 
-        serializer = OrderSerializer(order, many=True)
+        if request.accepted_renderer.format == 'json':
+            return stream_list(FastPartnerOrderSerializer, sub_orders, descending=True)
+        serializer = FastPartnerOrderSerializer(sub_orders, many=True)
         return Response(serializer.data)
 
 
+class PartnerOrderFeed(APIView):
+    """
+    Лента новых заказов поставщика вместо частого опроса partner/orders:
+    long-poll (JSON) или Server-Sent Events (Accept: text/event-stream).
+    Курсор - id подзаказа из параметра after или заголовка Last-Event-ID
+    """
+    renderer_classes = (FastJSONRenderer, EventStreamRenderer)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        shop_ids = set(Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
+        after = request.query_params.get('after') or request.META.get('HTTP_LAST_EVENT_ID')
+        if after is None:
+            # без курсора лента начинается с текущего момента
+            after = SubOrder.objects.filter(shop_id__in=shop_ids).aggregate(last=Max('id'))['last'] or 0
+        elif not str(after).isdigit():
+            return JsonResponse({'Status': False, 'Errors': 'Неправильно указан курсор'})
+        after = int(after)
+
+        if request.accepted_renderer.format == 'sse':
+            if not stream_slots.acquire(blocking=False):
+                return self.busy()
+            return self.stream(shop_ids, after)
+
+        sub_order_ids = self.missed(shop_ids, after)
+        if not sub_order_ids:
+            # ожидание занимает поток так же, как поток SSE, и берет слот из того же лимита
+            if not stream_slots.acquire(blocking=False):
+                return self.busy()
+            try:
+                # ожидающий клиент не занимает соединение с базой
+                connection.close()
+                sub_order_ids = order_feed.wait(shop_ids, after, settings.ORDER_FEED_TIMEOUT)
+            finally:
+                stream_slots.release()
+        return JsonResponse({'Status': True,
+                             'last_id': max(sub_order_ids, default=after),
+                             'orders': self.serialize(sub_order_ids)})
+
+    @staticmethod
+    def busy():
+        response = JsonResponse({'Status': False, 'Error': 'Слишком много ожидающих запросов'}, status=503)
+        response['Retry-After'] = settings.ORDER_FEED_KEEPALIVE
+        return response
+
+    @staticmethod
+    def missed(shop_ids, after):
+        """
+        Подзаказы, появившиеся после курсора, пока клиент не был подключен
+        """
+        return list(SubOrder.objects.filter(shop_id__in=shop_ids, id__gt=after).order_by('id').values_list(
+            'id', flat=True)[:settings.ORDER_FEED_BUFFER])
+
+    @staticmethod
+    def serialize(sub_order_ids):
+        if not sub_order_ids:
+            return []
+        return FastPartnerOrderSerializer(SubOrder.objects.filter(id__in=sub_order_ids).order_by('id'),
+                                          many=True).data
+
+    def stream(self, shop_ids, after):
+        """
+        Поток SSE ограниченной длительности, клиент переподключается сам с Last-Event-ID.
+        База читается только при подключении и при появлении событий.
+        Вызывается с занятым слотом stream_slots, слот освобождается при закрытии ответа
+        """
+        def generate():
+            last_id = after
+            sub_order_ids = self.missed(shop_ids, after)
+            deadline = monotonic() + settings.ORDER_FEED_STREAM_SECONDS
+            yield b'retry: 3000\n\n'
+            while True:
+                if sub_order_ids:
+                    last_id = sub_order_ids[-1]
+                    yield b'id: %d\nevent: orders\ndata: %s\n\n' % (last_id, dumps(self.serialize(sub_order_ids)))
+                else:
+                    yield b': keepalive\n\n'
+                if monotonic() >= deadline:
+                    break
+                connection.close()
+                sub_order_ids = order_feed.wait(shop_ids, last_id, min(settings.ORDER_FEED_KEEPALIVE,
+                                                                     deadline - monotonic()))
+
+        response = StreamingHttpResponse(SlotStream(generate()), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx не должен буферизовать поток
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class PartnerOrderStatus(APIView):
+    """
+    Класс для массовой смены статуса заказов поставщиком
+    """
+    throttle_scope = 'orders'
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        items_sting = request.data.get('items')
+        status = request.data.get('status')
+        if items_sting and status:
+            if not allowed_sources(status):
+                return JsonResponse({'Status': False, 'Errors': 'Недопустимый статус'})
+            items_list = items_sting.split(',') if isinstance(items_sting, str) else items_sting
+            order_ids = [order_id for order_id in map(str, items_list) if order_id.isdigit()]
+            # поставщик меняет статус только тех заказов, все позиции которых из его магазинов;
+            # заказы с позициями других магазинов меняет администратор
+            own_orders = Order.objects.filter(sub_orders__shop__user_id=request.user.id).exclude(
+                id__in=SubOrder.objects.exclude(shop__user_id=request.user.id).values('order_id'))
+            updated, rejected = transition_orders(order_ids, status, own_orders)
+            return JsonResponse({'Status': True, 'Обновлено': updated, 'Отклонено': rejected})
+
+        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+
+
 class ContactView(APIView):
     """
     Класс для работы с контактами покупателей
@@ -481,21 +806,24 @@ class OrderView(APIView):
     """
     Класс для получения и размешения заказов пользователями
     """
+    replica_reads = True
+    throttle_scope = 'orders'
+
 
     # получить мои заказы
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
         order = Order.objects.filter(
-            user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'orderitems__product__category',
-            'orderitems__product__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('orderitems__quantity') * F('orderitems__product__product_info__price'),output_field=DecimalField())).distinct()
+            user_id=request.user.id).exclude(status='basket').with_total_sum()
 
-        serializer = OrderSerializer(order, many=True)
+        if request.accepted_renderer.format == 'json':
+            return stream_list(FastOrderSerializer, order, descending=True)
+        serializer = FastOrderSerializer(order, many=True)
         return Response(serializer.data)
 
     # разместить заказ из корзины
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -503,25 +831,103 @@ class OrderView(APIView):
         if {'id', 'contact'}.issubset(request.data):
             if request.data['id'].isdigit():
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        status='new')
+                    with transaction.atomic():
+                        is_updated = Order.objects.filter(
+                            user_id=request.user.id, id=request.data['id'], status='basket').update(
+                            contact_id=request.data['contact'],
+                            status='new')
+                        if is_updated:
+                            price_order(request.data['id'])
+                            record_sales([int(request.data['id'])])
+                            # письма покупателю и магазинам уйдут через outbox только после фиксации заказа
+                            publish('order.placed', order_id=int(request.data['id']), user_id=request.user.id)
                 except IntegrityError as error:
                     print(error)
                     return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'})
+                except UnavailableItems as error:
+                    # заказ остается корзиной, покупатель видит, какие позиции убрать
+                    return JsonResponse({'Status': False, 'Errors': 'Часть товаров больше недоступна',
+                                         'Items': error.items})
                 else:
                     if is_updated:
-                        # new_order.send(sender=self.__class__, user_id=request.user.id)
-                        user_id = request.user.id
-                        new_order_func(user_id)
-                        thisorder = Order.objects.get(user_id=request.user.id, id=request.data['id'])
-                        thisitems = thisorder.orderitems.all()
-                        user_list = [item.shop.user for item in thisitems]
-                        id_list = set([user.id for user in user_list])
-                        for id in id_list:
-                            # shop_notification.send(sender=self.__class__, user_id=id, id=request.data['id'])
-                            new_order_shop(id,request.data['id'])
                         return JsonResponse({'Status': True})
 
-        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
\ No newline at end of file
+        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+
+
+class SalesReport(APIView):
+    """
+    Класс для отчетов о продажах по дневным сводкам: выручка магазинов по дням (shops),
+    продукты и категории по убыванию выручки за период (products, categories).
+    Магазин видит только свои продажи, администратор - все
+    """
+    replica_reads = True
+    reports = {
+        'shops': (ShopSalesDaily, None),
+        'products': (ProductSalesDaily, 'product_id'),
+        'categories': (CategorySalesDaily, 'category_id'),
+    }
+
+    def get(self, request, kind, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop' and not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        if kind not in self.reports:
+            return JsonResponse({'Status': False, 'Errors': f'Доступные отчеты: {", ".join(self.reports)}'},
+                                status=404)
+        model, key = self.reports[kind]
+
+        params = request.query_params
+        try:
+            date_to = parse_date(params['to']) if params.get('to') else datetime.now().date()
+            date_from = parse_date(params['from']) if params.get('from') else date_to - timedelta(days=6)
+        except ValueError:
+            date_from = date_to = None
+        if not date_from or not date_to:
+            return JsonResponse({'Status': False, 'Errors': 'Неверно указан период'})
+        for name in ('shop_id', 'limit'):
+            if not params.get(name, '0').isdigit():
+                return JsonResponse({'Status': False, 'Errors': f'Неверно указан параметр {name}'})
+
+        queryset = model.objects.filter(day__gte=date_from, day__lte=date_to)
+        if not request.user.is_staff:
+            queryset = queryset.filter(shop__user_id=request.user.id)
+        if params.get('shop_id'):
+            queryset = queryset.filter(shop_id=params['shop_id'])
+
+        if key is None:
+            rows = shop_report(queryset)
+        else:
+            rows = top_report(queryset, key, min(int(params.get('limit') or 20), settings.SALES_REPORT_MAX_ROWS))
+        return JsonResponse({'Status': True, 'from': date_from, 'to': date_to, 'rows': rows})
+
+
+class TaskMetricsView(APIView):
+    """
+    Метрики задач celery и длины очередей в формате Prometheus, только для администраторов
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Только для администраторов'}, status=403)
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class OrderHistoryView(ListAPIView):
+    """
+    Класс для просмотра архивных заказов пользователя
+    """
+    replica_reads = True
+    serializer_class = ArchivedOrderSerializer
+
+    def get_queryset(self):
+        return ArchivedOrder.objects.filter(user_id=self.request.user.id).select_related(
+            'contact').prefetch_related('items')
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+        return super().get(request, *args, **kwargs)